@@ -0,0 +1,183 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Control socket of a running mount: one JSON request per line, {"command": ..., **arguments},
+answered by one JSON line, {"result": ...} or {"error": ...}.
+
+    b2fs4chia-admin stats
+    b2fs4chia-admin set cache_ttl 120
+    b2fs4chia-admin warm farm1/plot-k32-....plot 0 4194304
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import time
+
+from .cached_bucket import CachedBucket
+from .filetypes.B2UploadFile import B2UploadFile
+from .unix_server import PrivateUnixServer
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+DEFAULT_ADMIN_SOCKET = os.path.join(tempfile.gettempdir(), 'b2fs4chia-admin.sock')
+
+
+def _set_cache_timeout(filesystem, value):
+    filesystem.cache_timeout = value
+    for bucket in filesystem.buckets.values():
+        if bucket.lazy_listing:
+            bucket.directories.ttl = value
+        if isinstance(bucket.bucket_api, CachedBucket):
+            bucket.bucket_api.set_cache_timeout(value)
+
+
+def _set_min_read_length(filesystem, value):
+    filesystem.min_read_length = int(value)
+    filesystem.slo_monitor.set_min_read_length(int(value))
+    for file in filesystem.file_handles.files():
+        # files being uploaded have no cache
+        if not isinstance(file, B2UploadFile):
+            file.data_cache.min_read_length = int(value)
+
+
+def _set_max_fetches(filesystem, value):
+    for bucket in filesystem.buckets.values():
+        bucket.fetch_scheduler.resize(int(value))
+
+
+# settings which can be changed at runtime, and how
+SETTINGS = {
+    'cache_ttl': lambda filesystem, value: setattr(filesystem, 'cache_ttl', value),
+    'cache_timeout': _set_cache_timeout,
+    'pinned_cache_size': lambda filesystem, value: setattr(filesystem.pinned_budget, 'limit', int(value * MiB)),
+    'min_read_length': _set_min_read_length,
+    'warm_files': lambda filesystem, value: setattr(filesystem.file_handles, 'warm_files', int(value)),
+    'negative_cache_ttl': lambda filesystem, value: setattr(filesystem.negative_cache, 'ttl', value),
+    'max_fetches': _set_max_fetches,
+    'daily_budget': lambda filesystem, value: setattr(filesystem.cost_governor, 'daily_budget', value or None),
+}
+
+
+def stats(filesystem):
+    return {
+        'cache_ttl': filesystem.cache_ttl,
+        'cache_timeout': filesystem.cache_timeout,
+        'pinned_cache': {'used': filesystem.pinned_budget.used, 'limit': filesystem.pinned_budget.limit},
+        'min_read_length': filesystem.min_read_length,
+        'files': len(filesystem.file_handles.paths()),
+        'warm_files': filesystem.file_handles.warm_files,
+        'negative_cache': {'paths': len(filesystem.negative_cache), 'ttl': filesystem.negative_cache.ttl},
+        'buckets': {
+            name: {
+                'max_fetches': bucket.fetch_scheduler.max_fetches,
+                'fetch_limit': bucket.fetch_scheduler.slots(),
+                'fetches': bucket.fetch_scheduler.stats(),
+            }
+            for name, bucket in filesystem.buckets.items()
+        },
+        'slo': filesystem.slo_monitor.report()['buckets'],
+        'cost': filesystem.cost_governor.report(time.time()),
+    }
+
+
+def set_setting(filesystem, name, value):
+    if name not in SETTINGS:
+        raise ValueError(f'{name} is not one of {", ".join(sorted(SETTINGS))}')
+    SETTINGS[name](filesystem, float(value))
+    logger.info('set %s to %s', name, value)
+    return stats(filesystem)
+
+
+COMMANDS = {
+    'stats': stats,
+    'set': set_setting,
+    'flush': lambda filesystem, path: filesystem.evict(path),
+    'warm': lambda filesystem, path, offset, length: filesystem.prefetch(path, int(offset), int(length)),
+    'refresh': lambda filesystem: filesystem.refresh_listing(),
+    'dump_events': lambda filesystem: filesystem.event_ring.dump_to_file(),
+}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                command = COMMANDS[request.pop('command')]
+                reply = {'result': command(self.server.filesystem, **request)}
+            except Exception as e:
+                logger.warning('admin request %s failed: %s', line, e)
+                reply = {'error': f'{e.__class__.__name__}: {e}'}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+class AdminServer(PrivateUnixServer):
+    """
+    The socket can change anything about the mount, so only its user can connect
+    """
+
+    def __init__(self, socket_path, filesystem):
+        self.filesystem = filesystem
+        super().__init__(socket_path, _Handler)
+
+
+def call(socket_path, command, **arguments):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as connection:
+            connection.write(json.dumps(dict(arguments, command=command)).encode() + b'\n')
+            connection.flush()
+            return json.loads(connection.readline())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Control a running b2fs4chia mount')
+    parser.add_argument('--socket', default=DEFAULT_ADMIN_SOCKET, help='admin socket of the mount')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('stats', help='cache, fetch and deadline statistics')
+    set_parser = commands.add_parser('set', help=f'change one of {", ".join(sorted(SETTINGS))}')
+    set_parser.add_argument('name', choices=sorted(SETTINGS))
+    set_parser.add_argument('value', type=float)
+    flush_parser = commands.add_parser('flush', help='drop everything cached for a file')
+    flush_parser.add_argument('path', help='path of the file relative to the mountpoint')
+    warm_parser = commands.add_parser('warm', help='download a range of a file and keep it')
+    warm_parser.add_argument('path', help='path of the file relative to the mountpoint')
+    warm_parser.add_argument('offset', type=int)
+    warm_parser.add_argument('length', type=int)
+    commands.add_parser('refresh', help='list the bucket again now')
+    commands.add_parser('dump_events', help='write the event ring to a file')
+    args = vars(parser.parse_args(argv))
+
+    reply = call(args.pop('socket'), args.pop('command'), **args)
+    print(json.dumps(reply.get('result', reply), indent=2))
+    return 1 if 'error' in reply else 0
@@ -23,13 +23,29 @@
 
 import argparse
 import logging
+import signal
+import sys
+import threading
 import yaml
 
 from fuse import FUSE
 
-from .b2fuse_main import B2Fuse
+from .admin import DEFAULT_ADMIN_SOCKET
+from .b2fuse_main import B2Fuse, DEFAULT_CACHE_TTL, DEFAULT_PINNED_CACHE_SIZE
+from .bucket_mount import bucket_settings
+from .cost_governor import DEFAULT_EGRESS_PRICE
+from .fetch_scheduler import DEFAULT_MAX_FETCHES, DEFAULT_MAX_FETCHES_PER_HOST
+from .event_ring import DEFAULT_EVENT_RING_SIZE, DEFAULT_SAMPLE_EVERY
+from .file_handles import DEFAULT_WARM_FILES
+from .negative_cache import DEFAULT_KERNEL_NEGATIVE_TTL, DEFAULT_NEGATIVE_CACHE_TTL
+from .read_server import DEFAULT_READ_SOCKET
+from .sharded_listing import DEFAULT_LISTING_THREADS
+from .filetypes.sidecar import DEFAULT_SIDECAR_DIR, DEFAULT_SIDECAR_DIR_SIZE
+from .filetypes.B2UploadFile import DEFAULT_UPLOAD_PART_SIZE, DEFAULT_UPLOAD_THREADS
 from .version import VERSION
 
+MiB = 1024 * 1024
+
 
 def create_parser():
     parser = argparse.ArgumentParser()
@@ -65,9 +81,158 @@ def create_parser():
 
     parser.add_argument('--cache_timeout', type=int, help="B2 Bucket cache lifetime")
 
+    parser.add_argument('--cache_ttl', type=float, help="Lifetime of downloaded file ranges in seconds")
+
+    parser.add_argument(
+        '--pinned_cache_size',
+        type=int,
+        help="Memory in MiB for file ranges which are downloaded repeatedly and kept until they cool off"
+    )
+
+    parser.add_argument(
+        '--warm_files',
+        type=int,
+        help="Number of closed files which keep their cache in case they are opened again"
+    )
+
+    parser.add_argument(
+        '--sidecar_dir',
+        type=str,
+        help="Directory for local copies of plot headers and checkpoint tables"
+    )
+    parser.add_argument('--no_sidecars', dest='no_sidecars', action='store_true', help="do not keep sidecar files")
+    parser.add_argument(
+        '--sidecar_size',
+        type=int,
+        help="Disk space in MiB for sidecar files, the least recently used are deleted beyond it"
+    )
+
+    parser.add_argument(
+        '--plot_prefetch',
+        dest='plot_prefetch',
+        action='store_true',
+        help="walk the proof tree of plots ahead of chiapos during full proof lookups"
+    )
+
+    parser.add_argument('--max_fetches', type=int, help="Maximum number of range downloads in flight")
+    parser.add_argument(
+        '--max_fetches_per_host',
+        type=int,
+        help="Maximum number of range downloads in flight to a single download host"
+    )
+    parser.add_argument(
+        '--lazy_listing',
+        dest='lazy_listing',
+        action='store_true',
+        help="list every folder of the bucket on its own when it is accessed instead of the whole bucket"
+    )
+
+    parser.add_argument(
+        '--listing_threads',
+        type=int,
+        help="Number of concurrent requests when listing the whole bucket"
+    )
+
+    parser.add_argument(
+        '--negative_cache_ttl',
+        type=float,
+        help="Seconds during which a path which was not found is reported missing without looking it up"
+    )
+
+    parser.add_argument(
+        '--kernel_negative_ttl',
+        type=float,
+        help="Seconds during which the kernel remembers a missing path, even once a listing finds it"
+    )
+
+    parser.add_argument(
+        '--event_ring_size',
+        type=int,
+        help="Number of read and download events kept in memory, dumped to a file on SIGUSR1"
+    )
+    parser.add_argument(
+        '--event_sample_every',
+        type=int,
+        help="Record only one read out of this many in the event ring"
+    )
+
+    parser.add_argument(
+        '--fetch_processes',
+        type=int,
+        help="Download in this many worker processes instead of threads of the FUSE process, 0 to disable"
+    )
+
+    parser.add_argument(
+        '--cache_socket',
+        type=str,
+        help="Unix socket of a b2fs4chia-cache service shared with the other mounts of this host"
+    )
+
+    parser.add_argument(
+        '--s3_endpoint',
+        type=str,
+        help="Download ranges from this S3 compatible endpoint of B2, e.g. https://s3.us-west-002.backblazeb2.com"
+    )
+
+    parser.add_argument(
+        '--admin_socket',
+        type=str,
+        help="Accept `b2fs4chia-admin` commands on this Unix socket, e.g. %s" % DEFAULT_ADMIN_SOCKET
+    )
+
+    parser.add_argument(
+        '--read_socket',
+        type=str,
+        help="Serve range reads to local harvesters on this Unix socket, e.g. %s" % DEFAULT_READ_SOCKET
+    )
+
+    parser.add_argument(
+        '--upload_part_size',
+        type=int,
+        help="Upload files written to the mount in parts of this many MiB, 5 at least (default %s)"
+             % (DEFAULT_UPLOAD_PART_SIZE // MiB)
+    )
+
+    parser.add_argument(
+        '--upload_threads',
+        type=int,
+        help="Upload this many parts at once, which are kept in memory meanwhile (default %s)"
+             % DEFAULT_UPLOAD_THREADS
+    )
+
+    parser.add_argument(
+        '--daily_budget',
+        type=float,
+        help="Dollars a day downloads may cost, beyond which only reads of chiapos download (default: no budget)"
+    )
+
+    parser.add_argument(
+        '--egress_price',
+        type=float,
+        help="Dollars per GB downloaded, 0 behind a CDN without egress fees (default %s)" % DEFAULT_EGRESS_PRICE
+    )
+
+    parser.add_argument(
+        '--no_adaptive_fetches',
+        dest='no_adaptive_fetches',
+        action='store_true',
+        help="always allow --max_fetches range downloads instead of adapting to B2 latency and errors"
+    )
+
     return parser
 
 
+def dump_events_on_signal(filesystem):
+    # the main thread stays in libfuse and would never run a Python signal handler,
+    # so SIGUSR1 is blocked everywhere and waited for in a thread of its own
+    def wait_for_signals():
+        while True:
+            signal.sigwait({signal.SIGUSR1})
+            filesystem.event_ring.dump_to_file()
+
+    threading.Thread(target=wait_for_signals, daemon=True).start()
+
+
 def load_config(config_filename):
     with open(config_filename) as f:
         return yaml.load(f.read())
@@ -101,18 +266,127 @@ def main():
     else:
         config["cacheTimeout"] = 120
 
+    if args.cache_ttl:
+        config["cacheTtl"] = args.cache_ttl
+
+    if args.pinned_cache_size:
+        config["pinnedCacheSize"] = args.pinned_cache_size
+
+    if args.warm_files:
+        config["warmFiles"] = args.warm_files
+
+    if args.sidecar_dir:
+        config["sidecarDir"] = args.sidecar_dir
+
+    if args.no_sidecars:
+        config["sidecarDir"] = None
+
+    if args.sidecar_size:
+        config["sidecarSize"] = args.sidecar_size
+
+    if args.plot_prefetch:
+        config["plotPrefetch"] = True
+
+    if args.max_fetches:
+        config["maxFetches"] = args.max_fetches
+
+    if args.max_fetches_per_host:
+        config["maxFetchesPerHost"] = args.max_fetches_per_host
+
+    if args.no_adaptive_fetches:
+        config["adaptiveFetches"] = False
+
+    if args.lazy_listing:
+        config["lazyListing"] = True
+
+    if args.listing_threads:
+        config["listingThreads"] = args.listing_threads
+
+    if args.negative_cache_ttl is not None:
+        config["negativeCacheTtl"] = args.negative_cache_ttl
+
+    if args.kernel_negative_ttl is not None:
+        config["kernelNegativeTtl"] = args.kernel_negative_ttl
+
+    if args.event_ring_size:
+        config["eventRingSize"] = args.event_ring_size
+
+    if args.event_sample_every:
+        config["eventSampleEvery"] = args.event_sample_every
+
+    if args.fetch_processes is not None:
+        config["fetchProcesses"] = args.fetch_processes
+
+    if args.cache_socket:
+        config["cacheSocket"] = args.cache_socket
+
+    if args.s3_endpoint:
+        config["s3Endpoint"] = args.s3_endpoint
+
+    if args.admin_socket:
+        config["adminSocket"] = args.admin_socket
+
+    if args.read_socket:
+        config["readSocket"] = args.read_socket
+
+    if args.upload_part_size:
+        config["uploadPartSize"] = args.upload_part_size
+
+    if args.upload_threads:
+        config["uploadThreads"] = args.upload_threads
+
+    if args.daily_budget is not None:
+        config["dailyBudget"] = args.daily_budget
+
+    if args.egress_price is not None:
+        config["egressPrice"] = args.egress_price
+
+    try:
+        buckets = bucket_settings(config)
+    except ValueError as e:
+        sys.exit(f'Invalid configuration: {e}')
+
     args.options = {}  # additional options passed to FUSE
 
     if args.allow_other:
         args.options['allow_other'] = True
 
+    # blocked before any thread is started, so that every thread inherits the mask
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1})
+
     with B2Fuse(
-            config["accountId"],
-            config["applicationKey"],
-            config["bucketId"],
+            config.get("accountId"),
+            config.get("applicationKey"),
+            config.get("bucketId"),
             config["cacheTimeout"],
+            config.get("cacheTtl", DEFAULT_CACHE_TTL),
+            config.get("pinnedCacheSize", DEFAULT_PINNED_CACHE_SIZE // MiB) * MiB,
+            config.get("warmFiles", DEFAULT_WARM_FILES),
+            config.get("sidecarDir", DEFAULT_SIDECAR_DIR),
+            config.get("plotPrefetch", False),
+            config.get("maxFetches", DEFAULT_MAX_FETCHES),
+            config.get("maxFetchesPerHost", DEFAULT_MAX_FETCHES_PER_HOST),
+            config.get("adaptiveFetches", True),
+            config.get("lazyListing", False),
+            config.get("listingThreads", DEFAULT_LISTING_THREADS),
+            config.get("negativeCacheTtl", DEFAULT_NEGATIVE_CACHE_TTL),
+            config.get("eventRingSize", DEFAULT_EVENT_RING_SIZE),
+            config.get("eventSampleEvery", DEFAULT_SAMPLE_EVERY),
+            config.get("fetchProcesses", 0),
+            config.get("cacheSocket"),
+            buckets,
+            config.get("s3Endpoint"),
+            config.get("adminSocket"),
+            config.get("readSocket"),
+            config.get("uploadPartSize", DEFAULT_UPLOAD_PART_SIZE // MiB) * MiB,
+            config.get("uploadThreads", DEFAULT_UPLOAD_THREADS),
+            config.get("dailyBudget"),
+            config.get("egressPrice", DEFAULT_EGRESS_PRICE),
+            config.get("sidecarSize", DEFAULT_SIDECAR_DIR_SIZE // MiB) * MiB,
     ) as filesystem:
+        dump_events_on_signal(filesystem)
         FUSE(filesystem, args.mountpoint, nothreads=False, foreground=True, entry_timeout=1800, attr_timeout=1800,
+             negative_timeout=config.get("kernelNegativeTtl", DEFAULT_KERNEL_NEGATIVE_TTL),
              direct_io=True, kernel_cache=True, **args.options)
 
 
@@ -25,18 +25,37 @@ import errno
 import logging
 import threading
 
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from fuse import FuseOSError, Operations
 from stat import S_IFDIR, S_IFREG
 from time import time, sleep
-from typing import Set
-
-from b2sdk.v0 import InMemoryAccountInfo
-from b2sdk.v0 import B2Api, B2RawApi, B2Http
 
 from .filetypes.B2SequentialFileMemory import B2SequentialFileMemory
-from .directory_structure import DirectoryStructure
-from .cached_bucket import CachedBucket
+from .filetypes.B2UploadFile import B2UploadFile, DEFAULT_UPLOAD_PART_SIZE, DEFAULT_UPLOAD_THREADS, MIN_UPLOAD_PART_SIZE
+from .filetypes.admission import ByteBudget
+from .filetypes.data_cache import CACHE_STATS, MIN_READ_LEN_WITHOUT_CACHE
+from .filetypes.sidecar import SidecarStore, DEFAULT_SIDECAR_DIR, DEFAULT_SIDECAR_DIR_SIZE
+from .filetypes.plot_prefetch import PREFETCH_THREADS
+from .filetypes.read_ahead import ReadAheadStream, READ_AHEAD_THREADS
+from .admin import AdminServer
+from .bucket_mount import BucketMount
+from .cost_governor import CostGovernor, DEFAULT_EGRESS_PRICE
+from .fetch_scheduler import DEFAULT_MAX_FETCHES, DEFAULT_MAX_FETCHES_PER_HOST
+from .cache_service import CacheClient
+from .event_ring import EventRing, READ, DEFAULT_EVENT_RING_SIZE, DEFAULT_SAMPLE_EVERY
+from .file_handles import FileHandleTable, DEFAULT_WARM_FILES
+from .hints import HintWriters, HINTS_PATH, HINT_THREADS, merge_ranges
+from .negative_cache import NegativeCache, DEFAULT_NEGATIVE_CACHE_TTL
+from .read_server import ReadServer
+from .sharded_listing import DEFAULT_LISTING_THREADS
+from .slo_monitor import SloMonitor
+from .timer_wheel import TimerWheel
+
+DEFAULT_CACHE_TTL = 30
+DEFAULT_PINNED_CACHE_SIZE = 256 * 1024 * 1024
+# extended attributes of files are the cache statistics of the file under this prefix,
+# and the controls `prefetch` ("<offset> <length>") and `evict`
+XATTR_PREFIX = 'user.b2fs4chia.'
 
 
 class B2Fuse(Operations):
@@ -46,107 +65,181 @@ class B2Fuse(Operations):
             application_key,
             bucket_id,
             cache_timeout,
+            cache_ttl=DEFAULT_CACHE_TTL,
+            pinned_cache_size=DEFAULT_PINNED_CACHE_SIZE,
+            warm_files=DEFAULT_WARM_FILES,
+            sidecar_dir=DEFAULT_SIDECAR_DIR,
+            plot_prefetch=False,
+            max_fetches=DEFAULT_MAX_FETCHES,
+            max_fetches_per_host=DEFAULT_MAX_FETCHES_PER_HOST,
+            adaptive_fetches=True,
+            lazy_listing=False,
+            listing_threads=DEFAULT_LISTING_THREADS,
+            negative_cache_ttl=DEFAULT_NEGATIVE_CACHE_TTL,
+            event_ring_size=DEFAULT_EVENT_RING_SIZE,
+            event_sample_every=DEFAULT_SAMPLE_EVERY,
+            fetch_processes=0,
+            cache_socket=None,
+            buckets=None,
+            s3_endpoint=None,
+            admin_socket=None,
+            read_socket=None,
+            upload_part_size=DEFAULT_UPLOAD_PART_SIZE,
+            upload_threads=DEFAULT_UPLOAD_THREADS,
+            daily_budget=None,
+            egress_price=DEFAULT_EGRESS_PRICE,
+            sidecar_size=DEFAULT_SIDECAR_DIR_SIZE,
     ):
-        account_info = InMemoryAccountInfo()
-        self.api = B2Api(account_info, raw_api=B2RawApi(B2Http(user_agent_append='b2fs4chia')))
-        self.api.authorize_account('production', account_id, application_key)
-        self.bucket_api = CachedBucket(self.api, bucket_id, cache_timeout)
+        """
+        `buckets` is a list of dicts with the name of the top level folder of each bucket, a
+        bucket_id, and optionally its own account_id, application_key, max_fetches,
+        max_fetches_per_host and s3_endpoint; without it the bucket `bucket_id` is served at the root
+        """
+        self.cache_timeout = cache_timeout
+        self.local_directories = []
+        # ranges are shared with the other mounts of this host through the cache service listening there
+        self.cache_client = CacheClient(cache_socket) if cache_socket else None
 
         self.logger = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+        # reads and downloads are recorded here, text logs of them are only written in debug mode
+        self.event_ring = EventRing(event_ring_size, event_sample_every)
 
         self.B2File = B2SequentialFileMemory
 
-        self._directories = DirectoryStructure()
-        self.local_directories = []
-
-        self.open_files = defaultdict(self.B2File)
-        self.files_open_since_last_eviction: Set[str] = set()
-        self.files_to_revisit_during_next_eviction: Set[str] = set()
-        self.recently_open_files_lock = threading.Lock()
-
-        self.fd = 0
-        threading.Thread(target=self.evict_periodically).start()
-
-    def evict_periodically(self):
+        # paths which getattr did not find, forgotten when a listing finds them
+        self.negative_cache = NegativeCache(negative_cache_ttl)
+
+        # each bucket has its own sessions, fetch limits and listing, and shares everything below
+        bucket_settings = dict(
+            account_id=account_id,
+            application_key=application_key,
+            max_fetches=max_fetches,
+            max_fetches_per_host=max_fetches_per_host,
+            adaptive_fetches=adaptive_fetches,
+            lazy_listing=lazy_listing,
+            listing_threads=listing_threads,
+            fetch_processes=fetch_processes,
+            s3_endpoint=s3_endpoint,
+        )
+        if buckets:
+            self.buckets = {}
+            for bucket in buckets:
+                self.buckets[bucket['name']] = self._mount_bucket(**dict(bucket_settings, **bucket))
+        else:
+            self.buckets = {'': self._mount_bucket(bucket_id=bucket_id, **bucket_settings)}
+
+        self.file_handles = FileHandleTable(warm_files)
+        # reads which miss the cache download at least this many bytes
+        self.min_read_length = MIN_READ_LEN_WITHOUT_CACHE
+        # proof shaped read sessions of every plot against the deadlines of chia
+        self.slo_monitor = SloMonitor(self.min_read_length)
+        # downloads and their cost, which speculation and amplification give way to above daily_budget
+        self.cost_governor = CostGovernor(daily_budget, egress_price)
+
+        # every cached range which is not pinned gets a timer here when it is downloaded
+        self.cache_ttl = cache_ttl
+        self.timer_wheel = TimerWheel()
+        # ranges which keep being downloaded again are kept, up to this many bytes for all files
+        self.pinned_budget = ByteBudget(pinned_cache_size)
+        self.sidecar_store = SidecarStore(sidecar_dir, sidecar_size) if sidecar_dir else None
+        # shared by the prefetchers of all plots, so that speculation cannot starve demand reads
+        self.plot_prefetch_executor = ThreadPoolExecutor(
+            PREFETCH_THREADS, thread_name_prefix='plot_prefetch'
+        ) if plot_prefetch else None
+        # handles which read a file in order are served by read-ahead, outside of the cache
+        self.read_streams = {}
+        self.read_ahead_executor = ThreadPoolExecutor(READ_AHEAD_THREADS, thread_name_prefix='read_ahead')
+        # parts of files written to the mount are uploaded there, upload_threads of them in memory at most
+        self.upload_part_size = max(upload_part_size, MIN_UPLOAD_PART_SIZE)
+        self.upload_executor = ThreadPoolExecutor(upload_threads, thread_name_prefix='upload')
+        self.upload_slots = threading.BoundedSemaphore(upload_threads)
+        # ranges a harvester announces through the hints file are downloaded together
+        self.hint_writers = HintWriters()
+        self.hint_executor = ThreadPoolExecutor(HINT_THREADS, thread_name_prefix='hints')
+
+        threading.Thread(target=self.expire_periodically, daemon=True).start()
+
+        # settings can be changed and caches flushed or warmed through this socket while mounted
+        self.admin_server = AdminServer(admin_socket, self) if admin_socket else None
+        if self.admin_server is not None:
+            self.admin_server.start()
+        # harvesters on this host can read ranges through this socket instead of the kernel
+        self.read_server = ReadServer(read_socket, self) if read_socket else None
+        if self.read_server is not None:
+            self.read_server.start()
+
+    def expire_periodically(self):
         while True:
-            sleep(30)
-            with self.recently_open_files_lock:
-                files_to_evict = self.files_open_since_last_eviction | self.files_to_revisit_during_next_eviction
-                self.files_to_revisit_during_next_eviction = self.files_open_since_last_eviction
-                self.files_open_since_last_eviction = set()
-            evict_older_than = time() - 30
-            for file_name in files_to_evict:
-                try:
-                    self.open_files[file_name].evict(evict_older_than)
-                except Exception:
-                    self.logger.exception(f'Error when performing eviction for file {file_name}')
+            sleep(self.timer_wheel.tick)
+            now = time()
+            self.timer_wheel.advance(now)
+            self.slo_monitor.close_idle(now)
+            self.cost_governor.update(now)
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args, **kwargs):
-        return
+        if self.admin_server is not None:
+            self.admin_server.stop()
+        if self.read_server is not None:
+            self.read_server.stop()
+        for bucket in self.buckets.values():
+            bucket.shutdown()
 
     # Helper methods
     # ==================
 
+    def _mount_bucket(self, **settings):
+        return BucketMount.connect(self, **settings)
+
+    def _route(self, path):
+        """
+        return the bucket which serves `path` and the path within that bucket,
+        or None for the root of a mount of several buckets and for paths outside of them
+        """
+        if '' in self.buckets:
+            return self.buckets[''], path
+        name, _, bucket_path = path.partition('/')
+        return self.buckets.get(name), bucket_path
+
+    def _is_directory(self, path):
+        bucket, bucket_path = self._route(path)
+        if bucket is None:
+            return path == ''
+        return bucket.directories.is_directory(bucket_path)
+
+    def _get_file_info(self, path):
+        bucket, bucket_path = self._route(path)
+        if bucket is None:
+            return None
+        return bucket.directories.get_file_info(bucket_path)
+
     def _exists(self, path, include_hash=True):
         # Handle hash files
         if include_hash and path.endswith(".sha1"):
             path = path[:-5]
 
         # File is in bucket
-        if self._directories.is_file(path):
+        bucket, bucket_path = self._route(path)
+        if bucket is not None and bucket.directories.is_file(bucket_path):
             return True
 
         # File is open (but possibly not in bucket)
-        if path in self.open_files.keys():
+        if self.file_handles.peek(path) is not None:
             return True
 
         return False
 
     def _get_memory_consumption(self):
-        open_file_sizes = map(lambda f: len(f), self.open_files.values())
+        open_file_sizes = map(lambda f: len(f), self.file_handles.files())
 
         memory = sum(open_file_sizes)
 
         return float(memory) / (1024 * 1024)
 
     def _get_cloud_space_consumption(self):
-
-        directories = [self._directories._directories]
-
-        space_consumption = 0
-        while len(directories) > 0:
-            directory = directories.pop(0)
-
-            directories.extend(directory.get_directories())
-
-            for file_info in directory.get_file_infos():
-                space_consumption += file_info['size']
-
-        return space_consumption
-
-    def _update_directory_structure(self):
-        # Update the directory structure with online files and local directories
-        def build_file_info_dict(file_info_object):
-            file_info = file_info_object.as_dict()
-            file_info["contentSha1"] = file_info_object.content_sha1
-            return file_info
-
-        online_files = [
-            build_file_info_dict(file_info_object)
-            for file_info_object, _ in self.bucket_api.ls(recursive=True)
-        ]
-        self._directories.update_structure(online_files, self.local_directories)
-
-    def _remove_local_file(self, path, delete_online=True):
-        if path in self.open_files.keys():
-            self.open_files[path].delete(delete_online)
-            del self.open_files[path]
-        elif delete_online:
-            file_info = self._directories.get_file_info(path)
-            self.bucket_api.delete_file_version(file_info['fileId'], file_info['fileName'])
+        return sum(bucket.directories.space_consumption() for bucket in self.buckets.values())
 
     def _remove_start_slash(self, path):
         if path.startswith("/"):
@@ -161,7 +254,7 @@ class B2Fuse(Operations):
         path = self._remove_start_slash(path)
 
         # Return access granted if path is a directory
-        if self._directories.is_directory(path):
+        if self._is_directory(path) or path == HINTS_PATH:
             return
 
         # Return access granted if path is a file
@@ -170,8 +263,9 @@ class B2Fuse(Operations):
 
         raise FuseOSError(errno.EACCES)
 
-    # def chmod(self, path, mode):
-    #    self.logger.debug("Chmod %s (mode:%s)", path, mode)
+    def chmod(self, path, mode):
+        # B2 files have no mode, accepted so that copies which preserve it do not fail
+        self.logger.debug("Chmod %s (mode:%s)", path, mode)
 
     # def chown(self, path, uid, gid):
     #    self.logger.debug("Chown %s (uid:%s gid:%s)", path, uid, gid)
@@ -181,8 +275,15 @@ class B2Fuse(Operations):
         # self.logger.debug("Memory used %s", round(self._get_memory_consumption(), 2))
         path = self._remove_start_slash(path)
 
+        if path == HINTS_PATH:
+            # write only, and always empty
+            return dict(st_mode=(S_IFREG | 0o222), st_ctime=0, st_mtime=0, st_atime=0, st_nlink=1, st_size=0)
+
+        if path in self.negative_cache:
+            raise FuseOSError(errno.ENOENT)
+
         # Check if path is a directory
-        if self._directories.is_directory(path):
+        if self._is_directory(path):
             return dict(
                 st_mode=(S_IFDIR | 0o777),
                 st_ctime=time(),
@@ -196,12 +297,10 @@ class B2Fuse(Operations):
             # If file exist return attributes
             # self.logger.info("Get attr %s", path)
 
-            online_files = [l[0].file_name for l in self.bucket_api.ls()]
+            file_info = self._get_file_info(path)
 
-            if path in online_files:
+            if file_info is not None:
                 # print "File is in bucket"
-                file_info = self._directories.get_file_info(path)
-
                 seconds_since_jan1_1970 = int(file_info['uploadTimestamp'] / 1000.)
                 return dict(
                     st_mode=(S_IFREG | 0o777),
@@ -219,16 +318,24 @@ class B2Fuse(Operations):
                     st_mtime=0,
                     st_atime=0,
                     st_nlink=1,
-                    st_size=len(self.open_files[path])
+                    st_size=len(self.file_handles.peek(path))
                 )
 
+        self.negative_cache.add(path)
         raise FuseOSError(errno.ENOENT)
 
     def readdir(self, path, fh):
         self.logger.info("Readdir %s", path)
         path = self._remove_start_slash(path)
 
-        self._update_directory_structure()
+        bucket, bucket_path = self._route(path)
+        if bucket is None:
+            if path:
+                raise FuseOSError(errno.ENOENT)
+            # the root of a mount of several buckets
+            return ['.', '..'] + list(self.buckets)
+
+        bucket.update_directory_structure()
 
         dirents = []
 
@@ -245,13 +352,13 @@ class B2Fuse(Operations):
             return False
 
         # Add files found in bucket
-        directory = self._directories.get_directory(path)
+        directory = bucket.directories.get_directory(bucket_path)
 
-        online_files = map(lambda file_info: file_info['fileName'], directory.get_file_infos())
+        online_files = map(lambda file_info: bucket.prefix + file_info['fileName'], directory.get_file_infos())
         dirents.extend(online_files)
 
         # Add files kept in local memory
-        for filename in self.open_files.keys():
+        for filename in self.file_handles.paths():
             # File already listed
             if filename in dirents:
                 continue
@@ -271,7 +378,7 @@ class B2Fuse(Operations):
         dirents.extend(
             [
                 str(directory) for directory
-                in self._directories.get_directories(path)
+                in bucket.directories.get_directories(bucket_path)
             ]
         )
         return dirents
@@ -302,7 +409,8 @@ class B2Fuse(Operations):
         raise NotImplementedError
 
     def utimens(self, path, times=None):
-        raise NotImplementedError
+        # B2 files have their upload time, accepted so that copies which preserve times do not fail
+        self.logger.debug("Utimens %s", path)
 
     # File methods
     # ============
@@ -311,39 +419,218 @@ class B2Fuse(Operations):
         self.logger.debug("Open %s (flags:%s)", path, flags)
         path = self._remove_start_slash(path)
 
+        if path == HINTS_PATH:
+            return self.hint_writers.open()
+
         if not self._exists(path):
             raise FuseOSError(errno.EACCES)
 
-        elif self.open_files.get(path) is None:
-            file_info = self._directories.get_file_info(path)
-            self.open_files[path] = self.B2File(self, file_info)
+        if isinstance(self.file_handles.peek(path), B2UploadFile):
+            # still being written
+            raise FuseOSError(errno.EBUSY)
 
-        self.fd += 1
-        return self.fd
+        bucket, bucket_path = self._route(path)
+        file_info = bucket.directories.get_file_info(bucket_path)
+        # a warm file of a version which has since been replaced is dropped
+        return self.file_handles.open(path, lambda: self.B2File(bucket, file_info), file_info.get('fileId'))
 
     def create(self, path, mode, fi=None):
-        raise NotImplementedError
+        self.logger.info("Create %s (mode:%s)", path, mode)
+        path = self._remove_start_slash(path)
+
+        bucket, bucket_path = self._route(path)
+        if bucket is None or path == HINTS_PATH or self._is_directory(path):
+            raise FuseOSError(errno.EACCES)
+
+        # the cache of a previous version of the file
+        self.file_handles.discard(path)
+        if self.file_handles.peek(path) is not None:
+            raise FuseOSError(errno.EBUSY)
+
+        self.negative_cache.discard_if(lambda missing_path: missing_path == path)
+        return self.file_handles.open(path, lambda: B2UploadFile(bucket, bucket_path))
 
     def read(self, path, length, offset, fh):
-        self.logger.info("Read %s (len:%s offset:%s fh:%s)", path, length, offset, fh)
-        file_name = self._remove_start_slash(path)
-        with self.recently_open_files_lock:
-            self.files_open_since_last_eviction.add(file_name)
-        return self.open_files[file_name].read(offset, length)
+        self.event_ring.sample(READ, path, offset, length)
+        self.logger.debug("Read %s (len:%s offset:%s fh:%s)", path, length, offset, fh)
+        file = self.file_handles.get(fh)
+        if isinstance(file, B2UploadFile):
+            raise FuseOSError(errno.EBADF)
+        stream = self.read_streams.get(fh)
+        if stream is None:
+            stream = self.read_streams.setdefault(fh, ReadAheadStream(file.data_cache, self.read_ahead_executor))
+        data = stream.read(offset, length)
+        if data is None:
+            data = file.read(offset, length)
+        return data
 
     def write(self, path, data, offset, fh):
-        raise NotImplementedError
+        if self._remove_start_slash(path) == HINTS_PATH:
+            self.hint(self.hint_writers.write(fh, data))
+            return len(data)
+
+        file = self.file_handles.get(fh)
+        if not isinstance(file, B2UploadFile) or file.finished:
+            # files of the bucket are read only
+            raise FuseOSError(errno.EBADF)
+        try:
+            written = file.write(data, offset)
+        except Exception:
+            self.logger.error("Uploading %s failed", path, exc_info=True)
+            raise FuseOSError(errno.EIO)
+        if not written:
+            self.logger.warning("Write of %s at %s is out of order, %s bytes written so far", path, offset, len(file))
+            raise FuseOSError(errno.ESPIPE)
+        return len(data)
 
     def truncate(self, path, length, fh=None):
-        raise NotImplementedError
+        path = self._remove_start_slash(path)
+        if path == HINTS_PATH:
+            return
+        file = self.file_handles.peek(path)
+        if not isinstance(file, B2UploadFile):
+            raise FuseOSError(errno.EROFS)
+        if length != len(file):
+            raise FuseOSError(errno.ESPIPE)
+
+    def flush(self, path, fh):
+        if self._remove_start_slash(path) == HINTS_PATH:
+            return
+        file = self.file_handles.get(fh)
+        if isinstance(file, B2UploadFile) and not file.is_empty():
+            # the error of release does not reach close(), so the upload is finished here, on the
+            # first close after data was written; the close of a descriptor duplicated before
+            # anything was written, as a shell redirection does, leaves the file open for writing
+            self._upload(path, file)
 
     def release(self, path, fh):
-        raise NotImplementedError
-
-    def release(self, path, fh):  # TODO: see if this should be removed
         self.logger.debug("Release %s %s", path, fh)
+        stream = self.read_streams.pop(fh, None)
+        if stream is not None:
+            stream.close()
+        path = self._remove_start_slash(path)
+        if path == HINTS_PATH:
+            self.hint(self.hint_writers.release(fh))
+            return
+        file = self.file_handles.get(fh)
+        self.file_handles.release(fh)
+        if isinstance(file, B2UploadFile):
+            try:
+                self._upload(path, file)
+            finally:
+                # read back from the bucket from now on
+                self.file_handles.discard(path)
+
+    def _upload(self, path, file):
+        if file.finished:
+            return
+        try:
+            file_info = file.upload()
+        except Exception:
+            self.logger.error("Uploading %s failed", path, exc_info=True)
+            raise FuseOSError(errno.EIO)
+        file.b2fuse.add_uploaded(file_info)
+
+    # Extended attributes
+    # ===================
 
-        self.logger.debug("Flushing file in case it was dirty")
-        self.flush(self._remove_start_slash(path), fh)
+    def listxattr(self, path):
+        path = self._remove_start_slash(path)
+        if not self._exists(path, include_hash=False) or self._cached_file(path) is None:
+            return []
+        return [XATTR_PREFIX + name for name in CACHE_STATS]
 
-        self._remove_local_file(path, False)
+    def getxattr(self, path, name, position=0):
+        path = self._remove_start_slash(path)
+        if not name.startswith(XATTR_PREFIX) or name[len(XATTR_PREFIX):] not in CACHE_STATS:
+            raise FuseOSError(errno.ENODATA)
+        if not self._exists(path, include_hash=False):
+            raise FuseOSError(errno.ENOENT)
+        # a file with nothing cached has no statistics, rather than zeros which would look like
+        # an open file whose cache is empty
+        file = self._cached_file(path)
+        if file is None:
+            raise FuseOSError(errno.ENODATA)
+        return str(file.data_cache.stats()[name[len(XATTR_PREFIX):]]).encode()
+
+    def _cached_file(self, path):
+        """
+        the file object of `path` if it is open or warm, without opening it, unless it is being uploaded
+        """
+        file = self.file_handles.peek(path)
+        if isinstance(file, B2UploadFile):
+            return None
+        return file
+
+    def setxattr(self, path, name, value, options, position=0):
+        self.logger.info("Set xattr %s %s=%s", path, name, value)
+        path = self._remove_start_slash(path)
+        if name == XATTR_PREFIX + 'evict':
+            self.evict(path)
+        elif name == XATTR_PREFIX + 'prefetch':
+            try:
+                offset, length = map(int, value.split())
+            except ValueError:
+                raise FuseOSError(errno.EINVAL)
+            self.prefetch(path, offset, length)
+        else:
+            raise FuseOSError(errno.ENOTSUP)
+
+    # Cache controls
+    # ==============
+
+    def evict(self, path):
+        """
+        drop everything cached for a file
+        """
+        file = self._cached_file(self._remove_start_slash(path))
+        if file is not None:
+            file.data_cache.close()
+
+    def prefetch(self, path, offset, length):
+        """
+        download a range of a file in the background and keep it in the hot tier, within the pinned budget
+        """
+        path = self._remove_start_slash(path)
+        fh = self.open(path, 0)
+        threading.Thread(target=self._prefetch, args=(path, fh, offset, length), daemon=True).start()
+
+    def hint(self, hints):
+        """
+        download the ranges of {path: [(offset, length)]} concurrently, merging those close to each
+        other, and return once they are all cached
+        """
+        handles = []
+        fetches = []
+        try:
+            for path, ranges in hints.items():
+                try:
+                    fh = self.open(path, 0)
+                except FuseOSError:
+                    self.logger.warning("Ignoring hints of %s which does not exist", path)
+                    continue
+                handles.append(fh)
+                data_cache = self.file_handles.get(fh).data_cache
+                for offset, length in merge_ranges(ranges):
+                    fetches.append((path, self.hint_executor.submit(data_cache.hint, offset, length)))
+            for path, fetch in fetches:
+                try:
+                    fetch.result()
+                except Exception:
+                    self.logger.warning("Downloading hinted ranges of %s failed", path, exc_info=True)
+        finally:
+            for fh in handles:
+                self.file_handles.release(fh)
+
+    def refresh_listing(self):
+        for bucket in self.buckets.values():
+            bucket.refresh_listing()
+
+    def _prefetch(self, path, fh, offset, length):
+        try:
+            kept = self.file_handles.get(fh).data_cache.prefetch(offset, length)
+            self.logger.info("Prefetched %s bytes of %s from offset %s", kept, path, offset)
+        except Exception:
+            self.logger.warning("Prefetching %s failed", path, exc_info=True)
+        finally:
+            self.file_handles.release(fh)
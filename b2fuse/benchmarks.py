@@ -0,0 +1,221 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Stress benchmarks which run b2fs4chia components against simulated B2 endpoints.
+
+    python -m b2fuse.benchmarks read_path --threads 1 2 4 8 16
+    python -m b2fuse.benchmarks listing --threads 1 4 16 --latency 0.2
+    python -m b2fuse.benchmarks backends --threads 1 8 --latency 0
+
+Cache hits take no lock, but they are Python code holding the GIL, so their throughput does not
+grow with threads: about 62k, 74k and 67k hits/s with 1, 4 and 16 threads. Misses wait for the
+network without the GIL and scale with threads up to --max_fetches.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from b2sdk.v0 import B2Api, Bucket, InMemoryAccountInfo
+
+from .directory_structure import DirectoryStructure
+from .fakes import FakeBucketApi, FakeListingApi, make_data_cache, make_plot_names
+from .sharded_listing import ShardedListing
+from .storage_backends import B2SdkBackend, S3RangeBackend
+
+MiB = 1024 * 1024
+
+
+class FakeStorageServer(ThreadingHTTPServer):
+    """
+    Serves ranges of `content` on localhost, both as B2 downloads by file id and as S3 objects
+    of any bucket and key, after sleeping for `latency` seconds
+    """
+
+    daemon_threads = True
+
+    def __init__(self, content, latency):
+        self.content = content
+        self.latency = latency
+        super().__init__(('127.0.0.1', 0), _FakeStorageHandler)
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address
+
+
+class _FakeStorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        content = self.server.content
+        begin, end = 0, len(content) - 1
+        if 'Range' in self.headers:
+            begin, end = map(int, self.headers['Range'][len('bytes='):].split('-'))
+        if not self.path.startswith('/b2api/') and not self.headers.get('Authorization', '').startswith('AWS4'):
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = content[begin:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Content-Range', f'bytes {begin}-{end}/{len(content)}')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('x-bz-file-id', 'fake')
+        self.send_header('x-bz-file-name', 'fake.plot')
+        self.send_header('x-bz-content-sha1', 'none')
+        self.send_header('x-bz-upload-timestamp', '0')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_b2sdk_bucket(url, bucket_id='fake-bucket'):
+    """
+    a b2sdk bucket whose downloads go to `url`
+    """
+    account_info = InMemoryAccountInfo()
+    account_info.set_auth_data('fake', 'fake-token', url, url, 100 * MiB, 'fake-key', 'fake')
+    return Bucket(B2Api(account_info), bucket_id)
+
+
+def _run_threads(thread_count, duration, worker):
+    stop = time.time() + duration
+    counts = [0] * thread_count
+
+    def run(idx):
+        rng = random.Random(idx)
+        while time.time() < stop:
+            worker(rng)
+            counts[idx] += 1
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def bench_read_path(args):
+    """
+    Throughput of DataCache.get for cache hits and for misses with simulated network latency;
+    only misses are expected to scale with threads
+    """
+    bucket_api = FakeBucketApi(args.file_size * MiB, args.latency)
+    warm_cache = make_data_cache(bucket_api)
+    for offset in range(0, len(bucket_api.content), 16384):
+        warm_cache.get(offset, 16384)
+
+    def hit(rng):
+        warm_cache.get(rng.randrange(len(bucket_api.content) - 16384), 8192)
+
+    print(f'{"threads":>8} {"hits/s":>12} {"misses/s":>12}')
+    for thread_count in args.threads:
+        cold_cache = make_data_cache(bucket_api)
+
+        def miss(rng):
+            cold_cache.get(rng.randrange(len(bucket_api.content) - 16384), 8192)
+
+        hits = _run_threads(thread_count, args.duration, hit)
+        misses = _run_threads(thread_count, args.duration, miss)
+        print(f'{thread_count:>8} {hits:>12.0f} {misses:>12.0f}')
+
+
+def bench_listing(args):
+    """
+    Wall time of a full listing of a bucket of plots, for a few numbers of listing threads
+    """
+    print(f'{"folders":>8} {"threads":>8} {"seconds":>8} {"requests":>9}')
+    for folders in (1, 16):
+        bucket_api = FakeListingApi(make_plot_names(args.files, folders), args.latency)
+        for thread_count in args.threads:
+            bucket_api.requests = 0
+            directories = DirectoryStructure()
+            start = time.time()
+            ShardedListing(bucket_api, thread_count, args.page_size).list(directories.add_files)
+            elapsed = time.time() - start
+            print(f'{folders:>8} {thread_count:>8} {elapsed:>8.2f} {bucket_api.requests:>9}')
+
+
+def bench_backends(args):
+    """
+    Range downloads per second through b2sdk and through the S3 range backend, against a local server
+    """
+    server = FakeStorageServer(os.urandom(args.file_size * MiB), args.latency)
+    # in a process of its own, so that the CPU time of this process is spent on the client side only
+    server_process = multiprocessing.get_context('fork').Process(target=server.serve_forever, daemon=True)
+    server_process.start()
+    file_info = {'fileId': 'fake', 'fileName': 'fake.plot'}
+    backends = {
+        'b2sdk': B2SdkBackend(make_b2sdk_bucket(server.url)),
+        's3': S3RangeBackend(server.url, 'fake-key-id', 'fake-key', 'fake-bucket', max(args.threads)),
+    }
+    print(f'{"threads":>8} {"backend":>8} {"reads/s":>10} {"CPU us/read":>12}')
+    for thread_count in args.threads:
+        for name, backend in backends.items():
+            def read(rng):
+                backend.download(file_info, rng.randrange(len(server.content) - args.read_size), args.read_size)
+
+            cpu_start = time.process_time()
+            rate = _run_threads(thread_count, args.duration, read)
+            cpu = (time.process_time() - cpu_start) / (rate * args.duration)
+            print(f'{thread_count:>8} {name:>8} {rate:>10.0f} {cpu * 1e6:>12.0f}')
+    server_process.terminate()
+
+
+BENCHMARKS = {
+    'backends': bench_backends,
+    'listing': bench_listing,
+    'read_path': bench_read_path,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--duration', type=float, default=2.0, help="seconds per measurement")
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated B2 latency in seconds")
+    parser.add_argument('--file_size', type=int, default=4, help="size of the simulated file in MiB")
+    parser.add_argument('--files', type=int, default=100000, help="number of files in the simulated bucket")
+    parser.add_argument('--read_size', type=int, default=16384, help="bytes per range download")
+    parser.add_argument('--page_size', type=int, default=10000, help="files per simulated listing page")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
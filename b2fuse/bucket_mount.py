@@ -0,0 +1,244 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+from time import time
+from urllib.parse import urlparse
+
+from b2sdk.v0 import InMemoryAccountInfo
+from b2sdk.v0 import B2Api, B2RawApi, B2Http
+
+from .cached_bucket import CachedBucket
+from .directory_structure import DirectoryStructure, LazyDirectoryStructure
+from .fetch_scheduler import FetchScheduler, DEFAULT_MAX_FETCHES, DEFAULT_MAX_FETCHES_PER_HOST
+from .fetch_workers import FetchWorkerPool
+from .sharded_listing import ShardedListing, DEFAULT_LISTING_THREADS
+from .storage_backends import B2SdkBackend, S3RangeBackend
+from .token_manager import TokenManager
+
+logger = logging.getLogger(__name__)
+
+
+def _shared(name):
+    # read from the filesystem on every access, so that settings changed while mounted apply to every bucket
+    return property(lambda self: getattr(self.filesystem, name))
+
+
+class BucketMount:
+    """
+    One bucket of a mount, with its own B2 session, and so its own connection pool, fetch
+    scheduler and listing. Served at the root of the mount, or under the folder `name`
+    when the mount serves several buckets.
+
+    The files of the bucket get the bucket mount as their `b2fuse`: the caches, budgets and
+    timers they share with the other buckets are looked up on the filesystem.
+    """
+
+    cache_ttl = _shared('cache_ttl')
+    min_read_length = _shared('min_read_length')
+    timer_wheel = _shared('timer_wheel')
+    pinned_budget = _shared('pinned_budget')
+    sidecar_store = _shared('sidecar_store')
+    plot_prefetch_executor = _shared('plot_prefetch_executor')
+    cache_client = _shared('cache_client')
+    event_ring = _shared('event_ring')
+    slo_monitor = _shared('slo_monitor')
+    cost_governor = _shared('cost_governor')
+    upload_part_size = _shared('upload_part_size')
+    upload_executor = _shared('upload_executor')
+    upload_slots = _shared('upload_slots')
+
+    def __init__(
+            self,
+            filesystem,
+            bucket_api,
+            storage_backend,
+            download_host,
+            name='',
+            max_fetches=DEFAULT_MAX_FETCHES,
+            max_fetches_per_host=DEFAULT_MAX_FETCHES_PER_HOST,
+            adaptive_fetches=True,
+            lazy_listing=False,
+            listing_threads=DEFAULT_LISTING_THREADS,
+            token_manager=None,
+    ):
+        self.filesystem = filesystem
+        self.name = name
+        # prepended to file names of the bucket to get paths of the mount
+        self.prefix = name + '/' if name else ''
+        # renews the token of the session of bucket_api, if it has one
+        self.token_manager = token_manager
+        self.bucket_api = bucket_api
+        self.storage_backend = storage_backend
+        self.download_host = download_host
+        # every range download of every file of the bucket waits for a slot here
+        self.fetch_scheduler = FetchScheduler(max_fetches, max_fetches_per_host, adaptive_fetches)
+
+        # with lazy listing, every folder is listed on its own when it is used and cached for cache_timeout
+        self.lazy_listing = lazy_listing
+        if lazy_listing:
+            self.directories = LazyDirectoryStructure(
+                self.bucket_api, filesystem.cache_timeout, self._on_folder_listed
+            )
+        else:
+            self.directories = DirectoryStructure()
+        self.bucket_listing = ShardedListing(self.bucket_api, listing_threads)
+        self._listing_lock = threading.Lock()
+        self._listed_at = None
+        # files uploaded through the mount while the bucket is listed, which its pages may miss
+        self._uploads_lock = threading.Lock()
+        self._uploaded_while_listing = None
+
+    @classmethod
+    def connect(
+            cls,
+            filesystem,
+            account_id,
+            application_key,
+            bucket_id,
+            max_fetches=DEFAULT_MAX_FETCHES,
+            fetch_processes=0,
+            s3_endpoint=None,
+            **kwargs
+    ):
+        """
+        authorize a B2 session of its own and mount `bucket_id` with it;
+        `kwargs` are the other arguments of BucketMount
+        """
+        account_info = InMemoryAccountInfo()
+        api = B2Api(account_info, raw_api=B2RawApi(B2Http(user_agent_append='b2fs4chia')))
+        # renewed in the background long before it expires
+        token_manager = TokenManager(api, account_id, application_key)
+        token_manager.start()
+        bucket_api = CachedBucket(api, bucket_id, filesystem.cache_timeout)
+        if fetch_processes:
+            # the downloads run there and their ranges are shared with this process
+            storage_backend = FetchWorkerPool(fetch_processes, account_id, application_key, bucket_id)
+        elif s3_endpoint:
+            bucket_name = api.session.list_buckets(
+                account_info.get_account_id(), bucket_id=bucket_id
+            )['buckets'][0]['bucketName']
+            storage_backend = S3RangeBackend(s3_endpoint, account_id, application_key, bucket_name, max_fetches)
+        else:
+            storage_backend = B2SdkBackend(bucket_api)
+        download_host = urlparse(account_info.get_download_url()).netloc
+        return cls(
+            filesystem, bucket_api, storage_backend, download_host,
+            max_fetches=max_fetches, token_manager=token_manager, **kwargs
+        )
+
+    def update_directory_structure(self):
+        # Update the directory structure with online files and local directories
+        if self.lazy_listing:
+            # folders are listed again on access once their listing is older than cache_timeout
+            return
+
+        with self._listing_lock:
+            if self._listed_at is not None and time() - self._listed_at < self.filesystem.cache_timeout:
+                return
+            listed_at = time()
+            with self._uploads_lock:
+                self._uploaded_while_listing = []
+            # the visible structure is never changed by the listing, others may be iterating over it
+            directories = DirectoryStructure()
+            directories.update_structure([], self.filesystem.local_directories)
+            try:
+                self.bucket_listing.list(directories.add_files)
+            except Exception:
+                with self._uploads_lock:
+                    self._uploaded_while_listing = None
+                raise
+            with self._uploads_lock:
+                directories.add_files(self._uploaded_while_listing)
+                self._uploaded_while_listing = None
+                self.directories = directories
+            self._listed_at = listed_at
+            self.filesystem.negative_cache.discard_if(
+                lambda path: self.filesystem._is_directory(path) or self.filesystem._exists(path)
+            )
+
+    def add_uploaded(self, file_info):
+        """
+        show a file uploaded through the mount, also once the listing in progress is swapped in
+        """
+        with self._uploads_lock:
+            self.directories.add_files([file_info])
+            if self._uploaded_while_listing is not None:
+                self._uploaded_while_listing.append(file_info)
+
+    def refresh_listing(self):
+        if self.lazy_listing:
+            self.directories.invalidate()
+            return
+        with self._listing_lock:
+            if self._listed_at is not None:
+                # too old, while the current listing stays visible until the new one is done
+                self._listed_at = 0.0
+        self.update_directory_structure()
+
+    def _on_folder_listed(self, folder):
+        folder = self.prefix + folder if folder else self.name
+        self.filesystem.negative_cache.discard_if(lambda path: path.rpartition('/')[0] == folder)
+
+    def shutdown(self):
+        if self.token_manager is not None:
+            self.token_manager.stop()
+        self.storage_backend.shutdown()
+
+
+# keys of the entries of `buckets` in config.yaml, and the arguments of BucketMount.connect they are given as
+BUCKET_KEYS = {
+    'name': 'name',
+    'bucketId': 'bucket_id',
+    'accountId': 'account_id',
+    'applicationKey': 'application_key',
+    'maxFetches': 'max_fetches',
+    'maxFetchesPerHost': 'max_fetches_per_host',
+    's3Endpoint': 's3_endpoint',
+}
+
+
+def bucket_settings(config):
+    """
+    return the arguments of BucketMount.connect of every entry of `buckets`, or raise ValueError
+    """
+    buckets = []
+    names = set()
+    for idx, bucket in enumerate(config.get("buckets") or []):
+        if not isinstance(bucket, dict):
+            raise ValueError(f'entry {idx} of buckets is not a mapping')
+        unknown = set(bucket) - set(BUCKET_KEYS)
+        if unknown:
+            raise ValueError(f'entry {idx} of buckets has unknown keys {", ".join(sorted(unknown))}')
+        for key in ('name', 'bucketId'):
+            if not bucket.get(key):
+                raise ValueError(f'entry {idx} of buckets has no {key}')
+        name = str(bucket['name'])
+        if '/' in name:
+            raise ValueError(f'name {name} of entry {idx} of buckets contains a slash')
+        if name in names:
+            raise ValueError(f'name {name} is used by several entries of buckets')
+        names.add(name)
+        buckets.append({BUCKET_KEYS[key]: value for key, value in dict(bucket, name=name).items()})
+    return buckets
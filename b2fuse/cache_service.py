@@ -0,0 +1,318 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Range cache shared by the b2fs4chia mounts of a host.
+
+    b2fs4chia-cache --socket /run/user/1000/b2fs4chia-cache.sock --size 1024
+
+Mounts started with --cache_socket ask the service before downloading a range. The first
+mount to ask downloads it and hands it over as a file in the cache directory; mounts which
+ask for the same range meanwhile wait for that download instead of starting their own. Every
+mount maps the files it gets, so a range is in memory once for the whole host, within the
+budget of the service.
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+from .unix_server import PrivateUnixServer
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+DEFAULT_CACHE_SERVICE_SIZE = 1024 * MiB
+DEFAULT_CACHE_SOCKET = os.path.join(tempfile.gettempdir(), 'b2fs4chia-cache.sock')
+# a tmpfs, so that cached ranges never wait for a disk
+DEFAULT_CACHE_DIRECTORY = '/dev/shm/b2fs4chia-cache' if os.path.isdir('/dev/shm') else os.path.join(
+    tempfile.gettempdir(), 'b2fs4chia-cache'
+)
+RANGE_SUFFIX = '.range'
+# mounts wait this long for the download of another mount, then download on their own
+DOWNLOAD_WAIT_TIMEOUT = 5.0
+
+
+class CacheService:
+    """
+    Ranges of B2 files kept as files in `directory`, `size` bytes of them at most, least recently used first out
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, size=DEFAULT_CACHE_SERVICE_SIZE):
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(RANGE_SUFFIX):
+                os.unlink(os.path.join(directory, name))
+        self._condition = threading.Condition()
+        # (file id, begin, end) -> path, least recently used first
+        self._entries = OrderedDict()
+        self._ranges = {}  # file id -> set of (begin, end)
+        self._in_flight = {}  # file id -> set of (begin, end)
+        self._bytes = 0
+
+    @staticmethod
+    def _covering(ranges, begin, end):
+        for range_ in ranges:
+            if range_[0] <= begin and end <= range_[1]:
+                return range_
+        return None
+
+    def get(self, file_id, begin, end, timeout=DOWNLOAD_WAIT_TIMEOUT):
+        """
+        return (path, begin of the cached range) of a range which covers [begin, end), after waiting
+        for the download of such a range if there is one; otherwise return None: the caller has to
+        download [begin, end) and put() it, or abandon() it.
+
+        Raise TimeoutError when that download takes longer than `timeout`: the caller has to
+        download [begin, end) on its own, without putting it.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                range_ = self._covering(self._ranges.get(file_id, ()), begin, end)
+                if range_ is not None:
+                    key = (file_id,) + range_
+                    self._entries.move_to_end(key)
+                    return self._entries[key], range_[0]
+                if self._covering(self._in_flight.get(file_id, ()), begin, end) is None:
+                    self._in_flight.setdefault(file_id, set()).add((begin, end))
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'range [{begin}, {end}) of {file_id} is still being downloaded')
+                self._condition.wait(remaining)
+
+    def _end_flight(self, file_id, begin, end):
+        in_flight = self._in_flight.get(file_id)
+        if in_flight is not None:
+            in_flight.discard((begin, end))
+            if not in_flight:
+                del self._in_flight[file_id]
+        self._condition.notify_all()
+
+    def put(self, file_id, begin, end, path):
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+            raise ValueError(f'{path} is not in {self.directory}')
+        with self._condition:
+            self._end_flight(file_id, begin, end)
+            # a read past the end of the file comes back short, it only covers what it holds
+            end = min(end, begin + os.path.getsize(path))
+            key = (file_id, begin, end)
+            if key in self._entries or end <= begin:
+                os.unlink(path)
+                return
+            self._entries[key] = path
+            self._ranges.setdefault(file_id, set()).add((begin, end))
+            self._bytes += end - begin
+            while self._bytes > self.size and len(self._entries) > 1:
+                self._evict()
+
+    def abandon(self, file_id, begin, end):
+        with self._condition:
+            self._end_flight(file_id, begin, end)
+
+    def _evict(self):
+        (file_id, begin, end), path = self._entries.popitem(last=False)
+        ranges = self._ranges[file_id]
+        ranges.discard((begin, end))
+        if not ranges:
+            del self._ranges[file_id]
+        self._bytes -= end - begin
+        # mounts which mapped the file keep their mapping
+        os.unlink(path)
+
+    def stats(self):
+        with self._condition:
+            return {'ranges': len(self._entries), 'bytes': self._bytes, 'size': self.size}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    One JSON request per line, one JSON reply per line
+    """
+
+    def handle(self):
+        service = self.server.service
+        # ranges this mount has to download, given up if it goes away
+        leads = set()
+        try:
+            for line in self.rfile:
+                request = json.loads(line)
+                op = request['op']
+                if op == 'stats':
+                    reply = service.stats()
+                else:
+                    key = (request['file'], request['begin'], request['end'])
+                    if op == 'get':
+                        try:
+                            found = service.get(*key)
+                        except TimeoutError as e:
+                            logger.warning('%s, the mount downloads it too', e)
+                            reply = {}
+                        else:
+                            if found is None:
+                                leads.add(key)
+                                reply = {'directory': service.directory}
+                            else:
+                                reply = {'path': found[0], 'begin': found[1]}
+                    elif op == 'put':
+                        leads.discard(key)
+                        service.put(*key, request['path'])
+                        reply = {}
+                    elif op == 'abandon':
+                        leads.discard(key)
+                        service.abandon(*key)
+                        reply = {}
+                    else:
+                        reply = {'error': f'unknown op {op}'}
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+                self.wfile.flush()
+        finally:
+            for key in leads:
+                service.abandon(*key)
+
+
+class CacheServer(PrivateUnixServer):
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        super().__init__(socket_path, _Handler)
+
+
+class CacheClient:
+    """
+    Connection of a mount to the cache service, one socket per thread
+    """
+
+    def __init__(self, socket_path=DEFAULT_CACHE_SOCKET):
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    def _call(self, **request):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            connection = self._local.connection = sock.makefile('rwb')
+            sock.close()  # the file keeps the connection open
+        try:
+            connection.write(json.dumps(request).encode() + b'\n')
+            connection.flush()
+            line = connection.readline()
+            if not line:
+                raise ConnectionError('the cache service closed the connection')
+        except OSError:
+            self._local.connection = None
+            connection.close()
+            raise
+        return json.loads(line)
+
+    def fetch(self, file_id, offset, length, download):
+        """
+        return a range from the cache service, or `download()` it, once for all mounts, and hand it over
+        """
+        end = offset + length
+        try:
+            reply = self._call(op='get', file=file_id, begin=offset, end=end)
+        except OSError as e:
+            logger.warning('cache service unavailable, downloading on our own: %s', e)
+            return download()
+        if 'path' in reply:
+            try:
+                return self._map(reply['path'], offset - reply['begin'], length)
+            except FileNotFoundError:
+                # evicted since the reply
+                return download()
+        if 'directory' not in reply:
+            # the download of another mount takes too long
+            return download()
+
+        try:
+            data = download()
+        except BaseException:
+            try:
+                self._call(op='abandon', file=file_id, begin=offset, end=end)
+            except OSError as e:
+                # the service gives the range up when the connection goes away
+                logger.warning('could not abandon a range at the cache service: %s', e)
+            raise
+        path = None
+        try:
+            fd, path = tempfile.mkstemp(suffix=RANGE_SUFFIX, dir=reply['directory'])
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._call(op='put', file=file_id, begin=offset, end=end, path=path)
+        except OSError as e:
+            logger.warning('could not hand a range over to the cache service: %s', e)
+            if path is not None:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        return data
+
+    @staticmethod
+    def _map(path, start, length):
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        if start == 0 and len(data) == length:
+            return data
+        # only part of a bigger range, copied so the mapping of the rest can go
+        return data[start:start + length]
+
+    def stats(self):
+        return self._call(op='stats')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Range cache shared by the b2fs4chia mounts of a host')
+    parser.add_argument('--socket', default=DEFAULT_CACHE_SOCKET, help='Unix socket the mounts connect to')
+    parser.add_argument('--directory', default=DEFAULT_CACHE_DIRECTORY, help='Directory of the cached ranges')
+    parser.add_argument('--size', type=int, default=DEFAULT_CACHE_SERVICE_SIZE // MiB, help='Cache size in MiB')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format='%(asctime)s %(message)s')
+
+    server = CacheServer(args.socket, CacheService(args.directory, args.size * MiB))
+    logger.info('serving %s MiB in %s on %s', args.size, args.directory, args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
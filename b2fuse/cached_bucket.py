@@ -21,6 +21,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
 import logging
 
 from time import time
@@ -29,6 +30,15 @@ from b2sdk.v0 import Bucket
 
 logger = logging.getLogger(__name__)
 
+# B2 sets the content type from the extension of the file name
+UPLOAD_CONTENT_TYPE = 'b2/x-auto'
+
+
+def build_file_info_dict(file_info_object):
+    file_info = file_info_object.as_dict()
+    file_info["contentSha1"] = file_info_object.content_sha1
+    return file_info
+
 
 # General cache used for B2Bucket
 class Cache(object):
@@ -66,6 +76,11 @@ class CachedBucket(Bucket):
     def _reset_cache(self):
         self._cache = {}
 
+    def set_cache_timeout(self, timeout):
+        self._cache_timeout = timeout
+        for cache in self._cache.values():
+            cache.cache_timeout = timeout
+
     def _update_cache(self, cache_name, result, params=""):
         logger.info('cache miss: %s, %s', cache_name, str(params))
         self._cache[cache_name].update(result, params)
@@ -94,8 +109,75 @@ class CachedBucket(Bucket):
             ))
             return self._update_cache(func_name, result)
 
+    def list_file_names_page(self, start_file_name, fetch_count=10000, prefix='', delimiter=None):
+        """
+        return file info dicts of one page of files from `start_file_name` on, the names of the folders
+        in that page (ending with the delimiter) if a delimiter is given, and the name which follows the page
+        """
+        # b2sdk does not pass a delimiter to B2, so folders are collapsed here and skipped like Bucket.ls does
+        response = self.api.session.list_file_names(self.id_, start_file_name, fetch_count, prefix)
+        file_infos = []
+        folders = []
+        for entry in response['files']:
+            end_of_folder = entry['fileName'].find(delimiter, len(prefix)) if delimiter else -1
+            if end_of_folder >= 0:
+                folder = entry['fileName'][:end_of_folder + 1]
+                if not folders or folders[-1] != folder:
+                    folders.append(folder)
+            else:
+                file_infos.append(build_file_info_dict(self.api.file_version_factory.from_api_response(entry)))
+        next_file_name = response['nextFileName']
+        if next_file_name is not None and folders and next_file_name.startswith(folders[-1]):
+            # the rest of the folder is not listed, the name which follows the delimiter comes after it
+            next_file_name = folders[-1][:-1] + chr(ord(delimiter) + 1)
+        return file_infos, folders, next_file_name
+
+    def ls_folder(self, folder_to_list='', fetch_count=10000):
+        """
+        return file info dicts of the files directly in a folder, and the names of its subfolders
+        """
+        prefix = folder_to_list + '/' if folder_to_list else ''
+        start_file_name = prefix
+        file_infos = []
+        folders = []
+        while start_file_name is not None:
+            page_file_infos, page_folders, start_file_name = self.list_file_names_page(
+                start_file_name, fetch_count, prefix, '/'
+            )
+            file_infos.extend(page_file_infos)
+            folders.extend(folder[len(prefix):-1] for folder in page_folders)
+        logger.info('listed folder %r: %s files, %s folders', folder_to_list, len(file_infos), len(folders))
+        return file_infos, folders
+
     def delete_file_version(self, *args, **kwargs):
         raise NotImplementedError
 
-    def upload_bytes(self, *args, **kwargs):
-        raise NotImplementedError
+    def _uploaded(self, response):
+        self._reset_cache()
+        return build_file_info_dict(self.api.file_version_factory.from_api_response(response))
+
+    def upload_bytes(self, data_bytes, file_name, content_sha1):
+        """
+        return the file info dict of a new file `file_name` with `data_bytes`, uploaded in one request
+        """
+        return self._uploaded(self.api.session.upload_file(
+            self.id_, file_name, len(data_bytes), UPLOAD_CONTENT_TYPE, content_sha1, {}, io.BytesIO(data_bytes)
+        ))
+
+    def start_large_file(self, file_name):
+        """
+        return the file id of a new large file, whose parts are uploaded with upload_part()
+        """
+        return self.api.session.start_large_file(self.id_, file_name, UPLOAD_CONTENT_TYPE, {})['fileId']
+
+    def upload_part(self, file_id, part_number, data, sha1):
+        self.api.session.upload_part(file_id, part_number, len(data), sha1, io.BytesIO(data))
+
+    def finish_large_file(self, file_id, part_sha1s):
+        """
+        return the file info dict of a large file made of the parts uploaded so far
+        """
+        return self._uploaded(self.api.session.finish_large_file(file_id, part_sha1s))
+
+    def cancel_large_file(self, file_id):
+        self.api.session.cancel_large_file(file_id)
@@ -0,0 +1,113 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import time
+
+from b2sdk.v0.exception import B2ConnectionError, B2RequestTimeout, ServiceError, TooManyRequests
+
+logger = logging.getLogger(__name__)
+
+# errors which mean B2 is overloaded rather than that the request is wrong
+OVERLOAD_ERRORS = (B2ConnectionError, B2RequestTimeout, ServiceError, TooManyRequests)
+
+MIN_LIMIT = 2
+INITIAL_LIMIT = 8
+# the limit shrinks when the recent latency is this many times the baseline latency
+LATENCY_TOLERANCE = 2.0
+LATENCY_BACKOFF = 0.9
+ERROR_BACKOFF = 0.5
+# weight of a new sample in the recent latency
+RECENT_WEIGHT = 0.2
+# the baseline is the lowest latency of the current and of the previous window of this many seconds
+BASELINE_WINDOW = 300
+
+
+class AimdLimit:
+    """
+    Number of fetches allowed in flight, adjusted the way TCP adjusts its congestion window.
+
+    While the limit is reached and latency stays close to the lowest latency of the last few minutes, it grows
+    by one for every `limit` fetches. It shrinks by LATENCY_BACKOFF when the recent latency
+    is more than LATENCY_TOLERANCE times that baseline, and by ERROR_BACKOFF when B2 reports
+    being overloaded, at most once per recent latency so one burst is answered only once.
+
+    Not synchronized, the caller holds a lock.
+    """
+
+    def __init__(self, max_limit, min_limit=MIN_LIMIT, initial_limit=INITIAL_LIMIT):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self._limit = float(max(self.min_limit, min(initial_limit, max_limit)))
+        self.recent_latency = None
+        self._last_decrease = 0.0
+        self._window_start = None
+        self._window_min = None
+        self._previous_window_min = None
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def baseline_latency(self):
+        if self._previous_window_min is None:
+            return self._window_min
+        return min(self._window_min, self._previous_window_min)
+
+    def resize(self, max_limit):
+        self.max_limit = max_limit
+        self.min_limit = min(MIN_LIMIT, max_limit)
+        self._limit = max(self.min_limit, min(self._limit, max_limit))
+
+    def _decrease(self, factor, now):
+        if now - self._last_decrease < (self.recent_latency or 0):
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * factor)
+        logger.info('lowering fetch limit to %s', self.limit)
+
+    def on_success(self, latency, in_flight, now=None):
+        """
+        `in_flight` is the number of fetches which were running, including this one
+        """
+        now = time.time() if now is None else now
+        if self._window_start is None or now - self._window_start >= BASELINE_WINDOW:
+            self._previous_window_min = self._window_min
+            self._window_start = now
+            self._window_min = latency
+        else:
+            self._window_min = min(self._window_min, latency)
+        if self.recent_latency is None:
+            self.recent_latency = latency
+        else:
+            self.recent_latency += (latency - self.recent_latency) * RECENT_WEIGHT
+
+        if self.recent_latency > self.baseline_latency * LATENCY_TOLERANCE:
+            self._decrease(LATENCY_BACKOFF, now)
+        elif in_flight >= self.limit:
+            # only grow while the limit is what holds fetches back
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def on_error(self, error, now=None):
+        if isinstance(error, OVERLOAD_ERRORS):
+            self._decrease(ERROR_BACKOFF, time.time() if now is None else now)
@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+import threading
+
+from collections import defaultdict, deque
+
+from .fetch_scheduler import DEMAND, PRIORITY_NAMES
+
+logger = logging.getLogger(__name__)
+
+GB = 1000 ** 3
+
+# B2 prices in dollars: downloads are class B transactions, the first 2500 of a day are free
+TRANSACTION_PRICE = 0.004 / 10000
+FREE_TRANSACTIONS = 2500
+DEFAULT_EGRESS_PRICE = 0.01
+# reads are no longer amplified once the projected spending reaches this share of the budget
+SAVING_SHARE = 0.8
+REPORT_INTERVAL = 3600
+TOP_PLOTS = 10
+
+NORMAL = 'normal'
+SAVING = 'saving'
+OVER_BUDGET = 'over_budget'
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class CostGovernor:
+    """
+    Counts the downloads and downloaded bytes of every plot, and of every hour of the last day.
+
+    With a `daily_budget` in dollars, the spending of the last hour is projected over a day.
+    Once the projection, or the spending of the last 24 hours, gets close to the budget, reads
+    are no longer amplified beyond the minimum read length of the mount; once it reaches the
+    budget, prefetches and background downloads are refused, so that what is left goes to the
+    reads of proofs.
+    """
+
+    def __init__(self, daily_budget=None, egress_price=DEFAULT_EGRESS_PRICE, transaction_price=TRANSACTION_PRICE):
+        self.daily_budget = daily_budget
+        self.egress_price = egress_price
+        self.transaction_price = transaction_price
+        self.state = NORMAL
+        self._lock = threading.Lock()
+        self._hours = deque()  # [hour, downloads, bytes] of the last 24 hours
+        self._plots = defaultdict(lambda: [0, 0])  # (bucket name, file name) -> [downloads, bytes]
+        self._reported_at = None
+
+    def on_download(self, bucket_name, file_name, length, now):
+        hour = int(now // 3600)
+        with self._lock:
+            if not self._hours or self._hours[-1][0] != hour:
+                self._hours.append([hour, 0, 0])
+                while self._hours[0][0] <= hour - 24:
+                    self._hours.popleft()
+            self._hours[-1][1] += 1
+            self._hours[-1][2] += length
+            plot = self._plots[(bucket_name, file_name)]
+            plot[0] += 1
+            plot[1] += length
+
+    def cost(self, downloads, length, free_transactions=0):
+        return max(0, downloads - free_transactions) * self.transaction_price + length / GB * self.egress_price
+
+    def allows(self, priority):
+        return priority == DEMAND or self.state != OVER_BUDGET
+
+    def check(self, priority):
+        """
+        raise BudgetExceeded if a download of `priority` has to wait until spending goes down
+        """
+        if not self.allows(priority):
+            raise BudgetExceeded(f'{PRIORITY_NAMES[priority]} download refused, over the daily budget')
+
+    @property
+    def saving(self):
+        return self.state != NORMAL
+
+    def _spending(self, now):
+        hour, elapsed = divmod(now, 3600)
+        day = [0, 0]
+        last_hour = [0.0, 0.0]
+        for entry_hour, downloads, length in self._hours:
+            if entry_hour <= hour - 24:
+                continue
+            day[0] += downloads
+            day[1] += length
+            # the current hour so far and the end of the previous one
+            weight = 1.0 if entry_hour == hour else 1.0 - elapsed / 3600 if entry_hour == hour - 1 else 0.0
+            last_hour[0] += downloads * weight
+            last_hour[1] += length * weight
+        projected_daily = self.cost(last_hour[0] * 24, last_hour[1] * 24, FREE_TRANSACTIONS)
+        return {
+            'last_day': {'downloads': day[0], 'bytes': day[1], 'cost': self.cost(*day, FREE_TRANSACTIONS)},
+            'projected_daily_cost': projected_daily,
+            'projected_monthly_cost': projected_daily * 30,
+        }
+
+    def update(self, now):
+        """
+        compare the spending with the budget, and log a report every REPORT_INTERVAL seconds
+        """
+        with self._lock:
+            spending = self._spending(now)
+            state = NORMAL
+            if self.daily_budget is not None:
+                spent = max(spending['last_day']['cost'], spending['projected_daily_cost'])
+                if spent >= self.daily_budget:
+                    state = OVER_BUDGET
+                elif spent >= SAVING_SHARE * self.daily_budget:
+                    state = SAVING
+            if state != self.state:
+                logger.warning(
+                    'download spending is %s: $%.2f in the last day, $%.2f projected, for a budget of $%s',
+                    state, spending['last_day']['cost'], spending['projected_daily_cost'], self.daily_budget,
+                )
+                self.state = state
+            if self._reported_at is None:
+                self._reported_at = now
+            elif now - self._reported_at >= REPORT_INTERVAL:
+                self._reported_at = now
+                logger.info(
+                    'downloads of the last day: %s, %s bytes, $%.2f; projected $%.2f a month',
+                    spending['last_day']['downloads'], spending['last_day']['bytes'], spending['last_day']['cost'],
+                    spending['projected_monthly_cost'],
+                )
+
+    def report(self, now):
+        """
+        return the spending of the last day and its projection, and the plots which cost most since mounting
+        """
+        with self._lock:
+            report = self._spending(now)
+            plots = sorted(self._plots.items(), key=lambda item: self.cost(*item[1]), reverse=True)[:TOP_PLOTS]
+        report.update(
+            state=self.state,
+            daily_budget=self.daily_budget,
+            plots=[
+                {'bucket': bucket_name, 'file': file_name, 'downloads': downloads, 'bytes': length,
+                 'cost': self.cost(downloads, length)}
+                for (bucket_name, file_name), (downloads, length) in plots
+            ],
+        )
+        return report
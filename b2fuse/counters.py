@@ -0,0 +1,48 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+
+DEFAULT_STRIPES = 16
+
+
+class StripedCounter:
+    """
+    Counter split into stripes picked by thread id, so that threads updating it
+    concurrently almost never wait for each other.
+    """
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self._stripes = stripes
+        self._cells = [0] * stripes
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def add(self, value=1):
+        idx = threading.get_native_id() % self._stripes
+        with self._locks[idx]:
+            self._cells[idx] += value
+
+    def value(self):
+        return sum(self._cells)
+
+    def __int__(self):
+        return self.value()
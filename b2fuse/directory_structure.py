@@ -21,11 +21,20 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import logging
+import threading
+
+from collections import defaultdict
+from time import time
+
+logger = logging.getLogger(__name__)
+
 
 class Directory(object):
     def __init__(self, name):
         self._name = name
         self._content = []
+        self._files = {}
         self._directories = {}
 
     def __len__(self):
@@ -44,15 +53,15 @@ class Directory(object):
         self._directories[name] = Directory(name)
 
     def add_file(self, file_info):
+        replaced = self._files.get(str(file_info['fileName']))
+        if replaced is not None:
+            # a new version of the file
+            self._content.remove(replaced)
         self._content.append(file_info)
+        self._files[str(file_info['fileName'])] = file_info
 
     def get_file_info(self, name):
-        file_info = list(filter(lambda f: str(f['fileName']) == name, self._content))
-
-        if len(file_info) == 1:
-            return file_info[0]
-        else:
-            return None
+        return self._files.get(name)
 
     def get_file_infos(self):
         return self._content
@@ -78,6 +87,9 @@ class DirectoryStructure(object):
         for directory in local_directories_split:
             self._lookup(self._directories, directory, True)
 
+        self.add_files(file_info_list)
+
+    def add_files(self, file_info_list):
         online_directories_split = map(
             lambda file_info: file_info['fileName'].split("/")[:-1], file_info_list
         )
@@ -141,3 +153,115 @@ class DirectoryStructure(object):
             return directory.get_file_info(path)
         else:
             return None
+
+    def space_consumption(self):
+        directories = [self._directories]
+
+        space_consumption = 0
+        while len(directories) > 0:
+            directory = directories.pop(0)
+
+            directories.extend(directory.get_directories())
+
+            for file_info in directory.get_file_infos():
+                space_consumption += file_info['size']
+
+        return space_consumption
+
+
+class LazyDirectoryStructure(object):
+    """
+    Same interface as DirectoryStructure, but every folder is listed on its own, the first time
+    it is needed and again once its listing is older than `ttl`, so that the cost of listing
+    grows with the folders which are used rather than with the bucket.
+    """
+
+    def __init__(self, bucket_api, ttl, on_listed=None):
+        self.bucket_api = bucket_api
+        self.ttl = ttl
+        # called with the path of every folder which has just been listed
+        self.on_listed = on_listed
+        self._lock = threading.Lock()
+        self._listing_locks = defaultdict(threading.Lock)
+        self._listings = {}
+
+    def _listing(self, path):
+        entry = self._listings.get(path)
+        if entry is not None and time() - entry[0] < self.ttl:
+            return entry[1]
+        with self._lock:
+            listing_lock = self._listing_locks[path]
+        with listing_lock:
+            # another thread may have listed the folder in the meantime
+            entry = self._listings.get(path)
+            if entry is not None and time() - entry[0] < self.ttl:
+                return entry[1]
+            listed_at = time()
+            file_infos, folders = self.bucket_api.ls_folder(path)
+            directory = Directory(path.rpartition('/')[2])
+            for name in folders:
+                directory.add_directory(name)
+            for file_info in file_infos:
+                directory.add_file(file_info)
+        with self._lock:
+            self._listings = {
+                listed_path: listed for listed_path, listed in self._listings.items()
+                if listed_at - listed[0] < self.ttl
+            }
+            self._listings[path] = (listed_at, directory)
+            del self._listing_locks[path]
+        if self.on_listed is not None:
+            self.on_listed(path)
+        return directory
+
+    def invalidate(self):
+        """
+        list every folder again the next time it is used
+        """
+        with self._lock:
+            self._listings = {}
+
+    def add_files(self, file_info_list):
+        """
+        show files uploaded since their folders were listed
+        """
+        for file_info in file_info_list:
+            entry = self._listings.get(file_info['fileName'].rpartition('/')[0])
+            if entry is not None:
+                entry[1].add_file(file_info)
+
+    def is_directory(self, path):
+        return self.get_directory(path) is not None
+
+    def is_file(self, path):
+        return self.get_file_info(path) is not None
+
+    def get_directories(self, path):
+        directory = self.get_directory(path)
+        if directory is not None:
+            return directory.get_directories()
+        return None
+
+    def get_directory(self, path):
+        if len(path) > 0:
+            parent_path, _, name = path.rpartition('/')
+            parent = self.get_directory(parent_path)
+            if parent is None or parent.get_directory(name) is None:
+                return None
+        return self._listing(path)
+
+    def get_file_info(self, path):
+        directory = self.get_directory(path.rpartition('/')[0])
+        if directory is not None:
+            return directory.get_file_info(path)
+        return None
+
+    def space_consumption(self):
+        """
+        size of the files in the folders which are listed at the moment
+        """
+        return sum(
+            file_info['size']
+            for _, directory in self._listings.values()
+            for file_info in directory.get_file_infos()
+        )
@@ -0,0 +1,82 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import itertools
+import logging
+import os
+import tempfile
+
+from time import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENT_RING_SIZE = 65536
+DEFAULT_SAMPLE_EVERY = 1
+
+# kinds of events, followed by their fields
+READ = 'read'  # path, offset, length
+HIT = 'hit'  # file name, offset, length
+FETCH = 'fetch'  # file name, offset, length, seconds queued, seconds downloading, downloads in flight
+
+
+class EventRing:
+    """
+    The last `size` events of the read path, as (time, kind, *fields) tuples.
+
+    Recording an event is a tuple and a list assignment: the slot comes from itertools.count,
+    whose next() is atomic, so there is no lock. Frequent events are recorded through
+    sample(), which keeps one event out of `sample_every`.
+    """
+
+    def __init__(self, size=DEFAULT_EVENT_RING_SIZE, sample_every=DEFAULT_SAMPLE_EVERY):
+        self.size = size
+        self.sample_every = sample_every
+        self._events = [None] * size
+        self._slots = itertools.count()
+        self._samples = itertools.count()
+
+    def record(self, kind, *fields):
+        self._events[next(self._slots) % self.size] = (time(), kind) + fields
+
+    def sample(self, kind, *fields):
+        if next(self._samples) % self.sample_every == 0:
+            self._events[next(self._slots) % self.size] = (time(), kind) + fields
+
+    def snapshot(self):
+        """
+        return recorded events, oldest first
+        """
+        return sorted((event for event in list(self._events) if event is not None), key=lambda event: event[0])
+
+    def dump(self, f):
+        for event in self.snapshot():
+            f.write('%.6f %s %s\n' % (event[0], event[1], ' '.join(map(str, event[2:]))))
+
+    def dump_to_file(self, directory=None):
+        """
+        write the events to a new file and return its path
+        """
+        fd, path = tempfile.mkstemp(prefix=f'b2fs4chia-events-{os.getpid()}-', suffix='.log', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            self.dump(f)
+        logger.info('dumped events to %s', path)
+        return path
@@ -0,0 +1,150 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Simulated B2 endpoints and mount state, shared by the unit tests and the benchmarks
+"""
+
+import bisect
+import hashlib
+import os
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .bucket_mount import BucketMount
+from .cached_bucket import CachedBucket
+from .event_ring import EventRing
+from .filetypes.admission import ByteBudget
+from .filetypes.B2SequentialFileMemory import B2SequentialFileMemory
+from .filetypes.data_cache import MIN_READ_LEN_WITHOUT_CACHE
+from .negative_cache import NegativeCache
+from .storage_backends import B2SdkBackend
+from .timer_wheel import TimerWheel
+
+MiB = 1024 * 1024
+
+
+class FakeBucketApi:
+    """
+    Serves ranges of an in-memory file, made of `content` padded with random bytes,
+    after sleeping for `latency` seconds
+    """
+
+    def __init__(self, size, latency, content=b''):
+        self.content = content + os.urandom(size - len(content))
+        self.latency = latency
+        self.downloads = 0
+
+    def download_file_by_id(self, file_id, download_dest, range_=None):
+        time.sleep(self.latency)
+        self.downloads += 1
+        data = self.content[range_[0]:range_[1] + 1]
+        with download_dest.make_file_context(
+            file_id, 'fake', len(data), 'application/octet-stream', None, {}, 0, range_=range_,
+        ) as f:
+            f.write(data)
+
+
+class FakeListingApi:
+    """
+    Answers list_file_names_page like B2 does, after `latency` seconds
+    """
+
+    def __init__(self, file_names, latency):
+        self.file_names = sorted(file_names)
+        self.latency = latency
+        self.requests = 0
+
+    def list_file_names_page(self, start_file_name, fetch_count=10000, prefix='', delimiter=None):
+        time.sleep(self.latency)
+        self.requests += 1
+        file_infos = []
+        folders = []
+        idx = bisect.bisect_left(self.file_names, max(start_file_name, prefix))
+        while idx < len(self.file_names) and len(file_infos) + len(folders) < fetch_count:
+            name = self.file_names[idx]
+            if not name.startswith(prefix):
+                break
+            end_of_folder = name.find(delimiter, len(prefix)) if delimiter else -1
+            if end_of_folder >= 0:
+                # a folder counts as one entry, like in B2
+                folders.append(name[:end_of_folder + 1])
+                idx = bisect.bisect_left(self.file_names, name[:end_of_folder] + chr(ord(delimiter) + 1))
+            else:
+                file_infos.append({'fileId': 'id-' + name, 'fileName': name, 'size': 1, 'uploadTimestamp': 0})
+                idx += 1
+        next_name = None
+        if idx < len(self.file_names) and self.file_names[idx].startswith(prefix):
+            next_name = self.file_names[idx]
+        return file_infos, folders, next_name
+
+    ls_folder = CachedBucket.ls_folder
+
+
+def make_plot_names(count, folders=1):
+    """
+    names shaped like the ones chia gives to plots, spread over `folders` folders
+    """
+    rng = random.Random(0)
+    return [
+        'farm%i/plot-k32-2021-%02i-%02i-%02i-%02i-%s.plot' % (
+            idx % folders, rng.randint(5, 9), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59),
+            hashlib.sha256(b'%i' % idx).hexdigest(),
+        )
+        for idx in range(count)
+    ]
+
+
+class FakeFilesystem:
+    """
+    What the buckets of a mount share, without FUSE and B2 sessions
+    """
+
+    def __init__(self, cache_ttl=30, pinned_cache_size=64 * MiB, sidecar_store=None, plot_prefetch_executor=None,
+                 cache_client=None, slo_monitor=None, upload_part_size=10, upload_threads=2):
+        self.cache_timeout = 120
+        self.cache_ttl = cache_ttl
+        self.timer_wheel = TimerWheel()
+        self.pinned_budget = ByteBudget(pinned_cache_size)
+        self.sidecar_store = sidecar_store
+        self.plot_prefetch_executor = plot_prefetch_executor
+        self.event_ring = EventRing()
+        self.cache_client = cache_client
+        self.slo_monitor = slo_monitor
+        self.cost_governor = None
+        self.min_read_length = MIN_READ_LEN_WITHOUT_CACHE
+        self.negative_cache = NegativeCache()
+        self.upload_part_size = upload_part_size
+        self.upload_executor = ThreadPoolExecutor(upload_threads)
+        self.upload_slots = threading.BoundedSemaphore(upload_threads)
+
+
+def make_bucket_mount(bucket_api, name='', **kwargs):
+    return BucketMount(FakeFilesystem(**kwargs), bucket_api, B2SdkBackend(bucket_api), 'fake', name)
+
+
+def make_data_cache(bucket_api, file_name='fake.plot', **kwargs):
+    file_info = {'fileId': 'fake-' + file_name, 'fileName': file_name, 'size': len(bucket_api.content)}
+    return B2SequentialFileMemory(make_bucket_mount(bucket_api, **kwargs), file_info).data_cache
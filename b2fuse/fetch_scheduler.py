@@ -0,0 +1,192 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from collections import defaultdict
+
+from .concurrency_limit import AimdLimit
+
+logger = logging.getLogger(__name__)
+
+# priority classes, lower runs first
+DEMAND, PREFETCH, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {DEMAND: 'demand', PREFETCH: 'prefetch', BACKGROUND: 'background'}
+
+# demand reads wait for as long as it takes, other fetches are dropped if they cannot start before their deadline
+DEFAULT_DEADLINES = {DEMAND: 5.0, PREFETCH: 5.0, BACKGROUND: 600.0}
+# part of the slots a class may occupy, so that a demand read never waits for speculation to finish
+SLOT_SHARES = {DEMAND: 1.0, PREFETCH: 0.75, BACKGROUND: 0.25}
+
+DEFAULT_MAX_FETCHES = 32
+DEFAULT_MAX_FETCHES_PER_HOST = 16
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ('priority', 'host', 'granted', 'event')
+
+    def __init__(self, priority, host):
+        self.priority = priority
+        self.host = host
+        self.granted = False
+        self.event = threading.Event()
+
+
+class FetchStats:
+    __slots__ = ('fetches', 'dropped', 'queue_wait', 'network_time')
+
+    def __init__(self):
+        self.fetches = 0
+        self.dropped = 0
+        self.queue_wait = 0.0
+        self.network_time = 0.0
+
+
+class FetchScheduler:
+    """
+    Admits fetches by priority class and then by earliest deadline, within a global and a
+    per-host limit of fetches in flight.
+
+    The fetch runs on the calling thread once it is given a slot. Fetches in flight are never
+    interrupted, so lower classes are only allowed a share of the slots.
+
+    If `adaptive` is set, the number of slots follows an AimdLimit between a few and `max_fetches`.
+    """
+
+    def __init__(self, max_fetches=DEFAULT_MAX_FETCHES, max_fetches_per_host=DEFAULT_MAX_FETCHES_PER_HOST,
+                 adaptive=False):
+        self.max_fetches = max_fetches
+        self.max_fetches_per_host = max_fetches_per_host
+        self.limit = AimdLimit(max_fetches) if adaptive else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._host_in_flight = defaultdict(int)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._stats = defaultdict(FetchStats)
+
+    def slots(self):
+        """
+        return the number of fetches allowed in flight now
+        """
+        return self.max_fetches if self.limit is None else self.limit.limit
+
+    def resize(self, max_fetches):
+        with self._lock:
+            self.max_fetches = max_fetches
+            if self.limit is not None:
+                self.limit.resize(max_fetches)
+            self._dispatch()
+
+    def _can_start(self, priority, host):
+        return (
+            self._in_flight < max(1, int(self.slots() * SLOT_SHARES[priority])) and
+            self._host_in_flight[host] < self.max_fetches_per_host
+        )
+
+    def _dispatch(self):
+        """
+        give free slots to the first waiters in queue order which can take them
+        """
+        skipped = []
+        while self._queue and self._in_flight < self.slots():
+            entry = heapq.heappop(self._queue)
+            waiter = entry[-1]
+            if waiter.event.is_set():
+                continue
+            if not self._can_start(waiter.priority, waiter.host):
+                skipped.append(entry)
+                continue
+            self._in_flight += 1
+            self._host_in_flight[waiter.host] += 1
+            waiter.granted = True
+            waiter.event.set()
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    def run(self, priority, host, function, deadline=None):
+        """
+        return `function()` once it may run, raise DeadlineExceeded if a fetch of a speculative
+        class could not start before its deadline
+        """
+        queued = time.time()
+        if deadline is None:
+            deadline = queued + DEFAULT_DEADLINES[priority]
+        waiter = _Waiter(priority, host)
+        with self._lock:
+            heapq.heappush(self._queue, (priority, deadline, next(self._sequence), waiter))
+            self._dispatch()
+        if not waiter.granted:
+            timeout = None if priority == DEMAND else max(0.0, deadline - time.time())
+            waiter.event.wait(timeout)
+            with self._lock:
+                if not waiter.granted:
+                    # leave the entry in the queue, _dispatch skips it
+                    waiter.event.set()
+                    self._stats[priority].dropped += 1
+                    raise DeadlineExceeded(f'{PRIORITY_NAMES[priority]} fetch waited {time.time() - queued:.3f}s')
+        started = time.time()
+        error = None
+        try:
+            return function()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            finished = time.time()
+            with self._lock:
+                if self.limit is not None:
+                    if error is not None:
+                        self.limit.on_error(error, finished)
+                    elif priority != BACKGROUND:
+                        # background fetches are large, their latency says little about congestion
+                        self.limit.on_success(finished - started, self._in_flight, finished)
+                self._in_flight -= 1
+                self._host_in_flight[host] -= 1
+                stats = self._stats[priority]
+                stats.fetches += 1
+                stats.queue_wait += started - queued
+                stats.network_time += finished - started
+                self._dispatch()
+
+    def stats(self):
+        """
+        return fetch counts and total seconds spent queued and on the network, by priority class
+        """
+        with self._lock:
+            return {
+                PRIORITY_NAMES[priority]: {
+                    'fetches': stats.fetches,
+                    'dropped': stats.dropped,
+                    'queue_wait': stats.queue_wait,
+                    'network_time': stats.network_time,
+                }
+                for priority, stats in sorted(self._stats.items())
+            }
@@ -0,0 +1,194 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Range downloads in worker processes, so that TLS and HTTP parsing do not hold the GIL of the
+process which answers FUSE requests.
+"""
+
+import logging
+import mmap
+import multiprocessing
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from b2sdk.v0 import AbstractDownloadDestination, InMemoryAccountInfo
+from b2sdk.v0 import B2Api, B2RawApi, B2Http
+from b2sdk.v0.exception import B2ConnectionError, B2Error, ServiceError, TooManyRequests
+
+from .token_manager import TokenManager
+
+logger = logging.getLogger(__name__)
+
+# where multiprocessing.shared_memory keeps its segments on Linux
+SHARED_MEMORY_DIR = '/dev/shm'
+
+# set in every worker process by _init_worker
+_bucket = None
+
+# errors which survive being pickled back to the FUSE process; others, such as BadRequest, take
+# arguments their unpickling does not give them, and fail the pool instead of the download
+PICKLABLE_ERRORS = (B2ConnectionError, ServiceError, TooManyRequests)
+
+
+class _SharedMemoryWriter:
+
+    def __init__(self, buf):
+        self._buf = buf
+        self._position = 0
+
+    def write(self, data):
+        self._buf[self._position:self._position + len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position):
+        self._position = position
+
+    def flush(self):
+        pass
+
+
+class DownloadDestSharedMemory(AbstractDownloadDestination):
+    """
+    Writes a download straight into a new shared memory segment, which outlives this process
+    until the process which maps it unlinks it
+    """
+
+    def __init__(self):
+        self.name = None
+        self.size = 0
+
+    def make_file_context(self, file_id, file_name, content_length, content_type, content_sha1, file_info,
+                          mod_time_millis, range_=None):
+        return self._capture_context(content_length)
+
+    @contextmanager
+    def _capture_context(self, content_length):
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, size=max(content_length, 1))
+        try:
+            yield _SharedMemoryWriter(shm.buf)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        self.name = shm.name
+        self.size = content_length
+        shm.close()
+
+
+def _init_worker(account_id, application_key, bucket_id):
+    global _bucket
+    api = B2Api(InMemoryAccountInfo(), raw_api=B2RawApi(B2Http(user_agent_append='b2fs4chia')))
+    TokenManager(api, account_id, application_key).start()
+    _bucket = api.get_bucket_by_id(bucket_id)
+
+
+def _download(file_id, offset, length):
+    download_dest = DownloadDestSharedMemory()
+    try:
+        _bucket.download_file_by_id(file_id, download_dest, range_=(offset, offset + length - 1))
+    except PICKLABLE_ERRORS:
+        raise
+    except Exception as e:
+        raise B2Error(f'{e.__class__.__name__}: {e}')
+    return download_dest.name, download_dest.size
+
+
+def map_shared_memory(name, size):
+    """
+    return a read-only mmap of a segment written by a worker, and unlink the segment:
+    the memory is freed once the mmap and every slice of it are garbage collected
+    """
+    from multiprocessing import shared_memory
+    if not size:
+        data = b''
+    else:
+        fd = os.open(os.path.join(SHARED_MEMORY_DIR, name), os.O_RDONLY)
+        try:
+            data = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+    # attaching through SharedMemory keeps the resource tracker of multiprocessing in balance
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+    return data
+
+
+class FetchWorkerPool:
+    """
+    Pool of processes which download ranges into shared memory segments
+    """
+
+    def __init__(self, processes, account_id, application_key, bucket_id):
+        if not os.path.isdir(SHARED_MEMORY_DIR):
+            raise RuntimeError(f'fetch worker processes need shared memory segments in {SHARED_MEMORY_DIR}')
+        self.processes = processes
+        self._initargs = (account_id, application_key, bucket_id)
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self):
+        # the FUSE process runs threads already, forking it would copy their locks in any state
+        return ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    def download(self, file_info, offset, length):
+        """
+        return the range as a read-only buffer which supports len(), slicing and the buffer protocol
+        """
+        for _ in range(2):
+            executor = self._executor
+            try:
+                name, size = executor.submit(_download, file_info['fileId'], offset, length).result()
+                return map_shared_memory(name, size)
+            except BrokenProcessPool as e:
+                # a worker died and took every download in flight with it, which are tried once more
+                self._restart(executor)
+                error = e
+        raise B2ConnectionError(f'fetch workers failed: {error}')
+
+    def _restart(self, broken):
+        with self._lock:
+            if self._executor is not broken:
+                # restarted by another download
+                return
+            logger.warning('fetch worker pool is broken, starting new workers')
+            self._executor = self._start()
+        broken.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            self._executor.shutdown()
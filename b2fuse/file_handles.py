@@ -0,0 +1,152 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARM_FILES = 1000
+
+
+class OpenFile:
+    __slots__ = ('file', 'refcount')
+
+    def __init__(self, file):
+        self.file = file
+        self.refcount = 0
+
+
+class FileHandleTable:
+    """
+    Maps file handles returned by open() to file objects shared by every handle of the same path.
+
+    After the last handle of a path is released its file object, along with everything it
+    has cached, is kept in a bounded LRU pool of closed but warm files, so that reopening
+    the path does not need to download anything again.
+
+    File objects are created outside of the lock of the table, once per path however many
+    threads open it at the same time.
+    """
+
+    def __init__(self, warm_files=DEFAULT_WARM_FILES):
+        self.warm_files = warm_files
+        self._lock = threading.Lock()
+        self._last_fh = 0
+        self._handles: Dict[int, str] = {}
+        self._open: Dict[str, OpenFile] = {}
+        self._warm: 'OrderedDict[str, object]' = OrderedDict()
+        self._creating: Dict[str, threading.Event] = {}
+
+    def open(self, path, create_file, file_id=None) -> int:
+        """
+        return a new handle for `path`, calling `create_file()` if it is neither open nor warm,
+        or if its warm file is not the version `file_id` of the path
+        """
+        while True:
+            stale = None
+            with self._lock:
+                open_file = self._open.get(path)
+                if open_file is not None:
+                    return self._add_handle(path, open_file)
+                creating = self._creating.get(path)
+                if creating is None:
+                    file = self._warm.pop(path, None)
+                    if file is not None and file_id is not None and file.file_info.get('fileId') != file_id:
+                        stale, file = file, None
+                    if file is not None:
+                        return self._add_handle(path, self._opened(path, file))
+                    # created outside of the lock, so that a slow file does not hold back the others
+                    creating = self._creating[path] = threading.Event()
+                    break
+            # opened by another thread meanwhile, unless that failed
+            creating.wait()
+
+        try:
+            if stale is not None:
+                logger.info('%s was replaced, dropping the cache of its previous version', path)
+                stale.close()
+            file = create_file()
+            with self._lock:
+                return self._add_handle(path, self._opened(path, file))
+        finally:
+            with self._lock:
+                del self._creating[path]
+            creating.set()
+
+    def _opened(self, path, file):
+        open_file = self._open[path] = OpenFile(file)
+        return open_file
+
+    def _add_handle(self, path, open_file) -> int:
+        open_file.refcount += 1
+        self._last_fh += 1
+        self._handles[self._last_fh] = path
+        return self._last_fh
+
+    def get(self, fh):
+        return self._open[self._handles[fh]].file
+
+    def peek(self, path):
+        """
+        return the file object of `path` if it is open or warm, without opening it
+        """
+        open_file = self._open.get(path)
+        if open_file is not None:
+            return open_file.file
+        return self._warm.get(path)
+
+    def release(self, fh):
+        dropped = []
+        with self._lock:
+            path = self._handles.pop(fh)
+            open_file = self._open[path]
+            open_file.refcount -= 1
+            if open_file.refcount:
+                return
+            del self._open[path]
+            self._warm[path] = open_file.file
+            while len(self._warm) > self.warm_files:
+                dropped.append(self._warm.popitem(last=False))
+        for dropped_path, file in dropped:
+            logger.info('dropping cache of %s', dropped_path)
+            file.close()
+
+    def discard(self, path):
+        """
+        drop the warm file of `path`, if there is one
+        """
+        with self._lock:
+            file = self._warm.pop(path, None)
+        if file is not None:
+            file.close()
+
+    def paths(self):
+        with self._lock:
+            return list(self._open) + list(self._warm)
+
+    def files(self):
+        with self._lock:
+            return [open_file.file for open_file in self._open.values()] + list(self._warm.values())
@@ -45,5 +45,5 @@ class B2SequentialFileMemory(B2BaseFile):
     def set_dirty(self, new_value):
         self._dirty = new_value
 
-    def evict(self, older_than_timestamp: float):
-        self.data_cache.evict(older_than_timestamp)
+    def close(self):
+        self.data_cache.close()
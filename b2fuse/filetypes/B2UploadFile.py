@@ -0,0 +1,213 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+# Copyright (c) 2015 Sondre Engebraaten
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+
+from b2sdk.v0.exception import B2ConnectionError, ServiceError, TooManyRequests
+
+from .B2BaseFile import B2BaseFile
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+# B2 recommends 100MB parts, and does not accept parts below 5MB but the last one
+DEFAULT_UPLOAD_PART_SIZE = 100 * MiB
+MIN_UPLOAD_PART_SIZE = 5 * MiB
+DEFAULT_UPLOAD_THREADS = 4
+UPLOAD_ATTEMPTS = 5
+# how far ahead of the end of a file writes are held until the ones before them arrive
+UPLOAD_REORDER_WINDOW = 16 * MiB
+
+
+class B2UploadFile(B2BaseFile):
+    """
+    A new file written sequentially through FUSE. Once more than `upload_part_size` bytes have been
+    written, the file becomes a B2 large file: every part is uploaded in the background while the
+    next one is written, and writes wait while `upload_threads` parts of all files are in flight,
+    so that memory stays bounded whatever the size of the file; writers only wait for a slot
+    outside of the lock of the file, so that a slow part holds back the writer which completed
+    the next one only. Smaller files are uploaded in one request when they are closed. Writes of a multithreaded FUSE loop may arrive out of order:
+    those within UPLOAD_REORDER_WINDOW of the end of the file are held until the gap before them
+    is filled. SHA1 sums of the parts and of the file are updated with
+    every write, so that no part has to be read twice.
+    """
+
+    def __init__(self, b2fuse, file_name):
+        super(B2UploadFile, self).__init__(b2fuse, {'fileName': file_name, 'size': 0})
+        self.part_size = b2fuse.upload_part_size
+        self.finished = False
+        self._size = 0
+        self._sha1 = hashlib.sha1()
+        self._buffer = bytearray()
+        self._part_sha1 = hashlib.sha1()
+        self._file_id = None
+        self._parts = []  # (sha1, future) of every part sent
+        self._pending = {}  # offset: data of the writes past the end of the file
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def accepts(self, offset, length):
+        """
+        whether a write of `length` bytes at `offset` can be taken: parts already uploaded cannot
+        be changed, and writes too far ahead of the end of the file would hold too much memory
+        """
+        return self._size <= offset and offset + length - self._size <= UPLOAD_REORDER_WINDOW
+
+    def is_empty(self):
+        return not self._size and not self._pending
+
+    def write(self, data, offset):
+        """
+        write `data` at `offset`, appending it and the writes it was holding back, and uploading the
+        parts they complete. Return False if the write cannot be taken.
+        """
+        parts = []
+        with self._lock:
+            if not self.accepts(offset, len(data)) or offset in self._pending:
+                return False
+            for _, future in self._parts:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+            if offset > self._size:
+                self._pending[offset] = bytes(data)
+                return True
+            self._append_data(data, parts)
+            while self._size in self._pending:
+                self._append_data(self._pending.pop(self._size), parts)
+        for part in parts:
+            self._send(*part)
+        return True
+
+    def _append_data(self, data, parts):
+        self._sha1.update(data)
+        view = memoryview(data)
+        # a full part is only sent once data follows it, so that a large file always has two parts
+        while len(self._buffer) + len(view) > self.part_size:
+            filling = self.part_size - len(self._buffer)
+            self._append(view[:filling])
+            parts.append(self._cut_part())
+            view = view[filling:]
+        self._append(view)
+        self._size += len(data)
+
+    def _append(self, data):
+        self._buffer += data
+        self._part_sha1.update(data)
+
+    def _cut_part(self):
+        """
+        take the buffer as the next part, to be given to _send once the lock of the file is released
+        """
+        if self._file_id is None:
+            self._file_id = self._retry(self.b2fuse.bucket_api.start_large_file, self.file_info['fileName'])
+        data, sha1 = self._buffer, self._part_sha1.hexdigest()
+        self._buffer = bytearray()
+        self._part_sha1 = hashlib.sha1()
+        future = Future()
+        self._parts.append((sha1, future))
+        return len(self._parts), data, sha1, future
+
+    def _send(self, part_number, data, sha1, future):
+        def upload():
+            try:
+                future.set_result(self._retry(self.b2fuse.bucket_api.upload_part, file_id, part_number, data, sha1))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self.b2fuse.upload_slots.release()
+
+        file_id = self._file_id
+        self.b2fuse.upload_slots.acquire()
+        self.b2fuse.upload_executor.submit(upload)
+
+    def _retry(self, call, *args):
+        for attempt in range(UPLOAD_ATTEMPTS):
+            try:
+                return call(*args)
+            except (B2ConnectionError, ServiceError, TooManyRequests) as e:
+                if attempt == UPLOAD_ATTEMPTS - 1:
+                    raise
+                logger.info('retrying upload of %s after %s', self.file_info['fileName'], e)
+                time.sleep(2 ** attempt)
+
+    def upload(self):
+        """
+        upload what is left, and return the file info dict of the new file
+        """
+        if self.finished:
+            return self.file_info
+        self.finished = True
+        bucket_api = self.b2fuse.bucket_api
+        started = time.time()
+        try:
+            if self._pending:
+                raise ValueError(f'{min(self._pending) - self._size} bytes were never written at {self._size}')
+            if self._file_id is None:
+                file_info = self._retry(
+                    bucket_api.upload_bytes, bytes(self._buffer), self.file_info['fileName'], self._sha1.hexdigest()
+                )
+            else:
+                self._send(*self._cut_part())
+                for _, future in self._parts:
+                    future.result()
+                file_info = self._retry(
+                    bucket_api.finish_large_file, self._file_id, [sha1 for sha1, _ in self._parts]
+                )
+        except BaseException:
+            self.delete()
+            raise
+        finally:
+            self._buffer = bytearray()
+            self._pending = {}
+        logger.info(
+            'uploaded %s: %s bytes in %s parts, %.1fs after closing, sha1 %s',
+            self.file_info['fileName'], self._size, len(self._parts) or 1, time.time() - started,
+            self._sha1.hexdigest(),
+        )
+        self.file_info = file_info
+        return file_info
+
+    def delete(self):
+        """
+        give up the upload and the parts sent so far
+        """
+        self.finished = True
+        if self._file_id is not None:
+            try:
+                self.b2fuse.bucket_api.cancel_large_file(self._file_id)
+            except Exception:
+                logger.warning('cancelling the upload of %s failed', self.file_info['fileName'], exc_info=True)
+            self._file_id = None
+
+    def close(self):
+        if not self.finished:
+            logger.warning('%s was not uploaded', self.file_info['fileName'])
+            self.delete()
@@ -0,0 +1,95 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+
+MAX_COUNT = 15
+MASK_64 = (1 << 64) - 1
+
+
+class FrequencySketch:
+    """
+    Count-min sketch with 4 bit counters which are halved periodically, as in TinyLFU.
+
+    Updates are not synchronized: a lost increment under contention only makes the
+    estimate slightly lower, which is acceptable for an admission policy.
+    """
+
+    def __init__(self, width=512, depth=4, sample_size=None):
+        assert width & (width - 1) == 0, 'width must be a power of two'
+        self._width = width
+        self._depth = depth
+        self._table = bytearray(width * depth)
+        self.sample_size = sample_size or 10 * width
+        self._additions = 0
+
+    def _indexes(self, key: int):
+        for row in range(self._depth):
+            h = (key * 0x9E3779B97F4A7C15 + (row + 1) * 0xBF58476D1CE4E5B9) & MASK_64
+            h ^= h >> 31
+            yield row * self._width + (h & (self._width - 1))
+
+    def estimate(self, key: int) -> int:
+        return min(self._table[idx] for idx in self._indexes(key))
+
+    def increment(self, key: int) -> bool:
+        """
+        return True if this increment made the sketch age all counters
+        """
+        indexes = list(self._indexes(key))
+        current = min(self._table[idx] for idx in indexes)
+        if current < MAX_COUNT:
+            # conservative update: only raise the counters which hold the minimum
+            for idx in indexes:
+                if self._table[idx] == current:
+                    self._table[idx] = current + 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self.age()
+            return True
+        return False
+
+    def age(self):
+        self._table = bytearray(count >> 1 for count in self._table)
+        self._additions = 0
+
+
+class ByteBudget:
+    """
+    Number of bytes which all caches together may keep in a tier
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_reserve(self, size: int) -> bool:
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self._lock:
+            self.used -= size
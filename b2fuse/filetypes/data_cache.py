@@ -23,112 +23,346 @@
 import logging
 import time
 import threading
-from .evicted_interval_tree import EvictedIntervalTree
 
-from b2sdk.v0 import DownloadDestBytes
-from intervaltree import IntervalTree
+from .admission import FrequencySketch
+from ..event_ring import HIT, FETCH
+from ..fetch_scheduler import DEMAND, BACKGROUND
+from .plot_prefetch import PlotPrefetcher
+from .range_map import RangeMap, Segment, TEMP, PINNED, HOT
+from ..counters import StripedCounter
 
 logger = logging.getLogger(__name__)
 
 MIN_READ_LEN_WITHOUT_CACHE = 16384
+# reads of plots which keep missing their proof deadlines are amplified up to this
+MAX_READ_LEN_WITHOUT_CACHE = 256 * 1024
+
+# ranges are promoted to the hot tier when a block of this size had to be downloaded again,
+# and demoted when the counter of every block they cover has decayed to zero
+PROMOTION_BLOCK_SIZE = 65536
+PROMOTE_AFTER_DOWNLOADS = 2
+COOL_DOWN_INTERVAL = 3600
+# prefetches asked for by the operator are downloaded in ranges of this size
+PREFETCH_CHUNK = 4 * 1024 * 1024
+
+# statistics returned by DataCache.stats()
+CACHE_STATS = ('temp_bytes', 'pinned_bytes', 'hot_bytes', 'intervals', 'hit_ratio', 'fetches', 'last_fetch_latency')
 
 
 class DataCache:
 
     def __init__(self, b2_file):
         self.b2_file = b2_file
+        # only writers take the lock; readers work on whatever snapshot `ranges` points to
         self.lock = threading.Lock()
-        self.perm = IntervalTree()
-        self.temp = EvictedIntervalTree()
-        self.parallel_counter = 0
+        self.ranges = RangeMap()
+        self.parallel_counter = StripedCounter()
+        self.hits = StripedCounter()
+        self.misses = StripedCounter()
+        self.fetches = StripedCounter()
+        self.last_fetch_latency = None
+        self.sketch = FrequencySketch()
+        self.cool_down_timer = None
+        slo_monitor = self.b2_file.b2fuse.slo_monitor
+        if slo_monitor is None:
+            self.min_read_length = self.b2_file.b2fuse.min_read_length
+            self.promote_after = PROMOTE_AFTER_DOWNLOADS
+        else:
+            # plots which missed their deadlines keep reading more after they are closed
+            self.min_read_length, self.promote_after = slo_monitor.tuning(
+                self.b2_file.b2fuse.name, self.b2_file.file_info['fileName']
+            )
+        self.sidecar = None
+        self.prefetcher = None
+        prefetch_executor = self.b2_file.b2fuse.plot_prefetch_executor
+        if prefetch_executor is not None and self.b2_file.file_info['fileName'].endswith('.plot'):
+            self.prefetcher = PlotPrefetcher(self, prefetch_executor)
+        sidecar_store = self.b2_file.b2fuse.sidecar_store
+        if sidecar_store is not None:
+            sidecar_store.attach(self)
+
+    def download(self, offset, length, priority=DEMAND):
+        """
+        download a range without caching it, once the fetch scheduler lets a fetch of `priority` run
+        """
+        b2fuse = self.b2_file.b2fuse
+        if b2fuse.cost_governor is not None:
+            b2fuse.cost_governor.check(priority)
+        queued = time.time()
+
+        def scheduled_download():
+            return b2fuse.fetch_scheduler.run(
+                priority, b2fuse.download_host, lambda: self._download(offset, length, queued),
+            )
 
-    def _fetch_data(self, offset, length, keep_it):
-        download_dest = DownloadDestBytes()
-        self.parallel_counter += 1
+        if b2fuse.cache_client is not None:
+            # other mounts of this host may have downloaded it, or be downloading it
+            return b2fuse.cache_client.fetch(self.b2_file.file_info['fileId'], offset, length, scheduled_download)
+        return scheduled_download()
+
+    def _download(self, offset, length, queued):
+        self.parallel_counter.add(1)
         start = time.time()
-        self.b2_file.b2fuse.bucket_api.download_file_by_id(
-            self.b2_file.file_info['fileId'],
-            download_dest,
-            range_=(
-                offset,
-                length + offset - 1,
-            ),
-        )
-        data = download_dest.get_bytes_written()
-        end = time.time()
-        logger.info('\033[33mdownloading from b2: %s; offset = %s; length = %s; time=\033[0m%f, thr=%i' % (self.b2_file.file_info['fileName'], offset, length, end-start, self.parallel_counter))
-        self.parallel_counter -= 1
+        try:
+            data = self.b2_file.b2fuse.storage_backend.download(self.b2_file.file_info, offset, length)
+            end = time.time()
+            self.last_fetch_latency = end - start
+            if self.b2_file.b2fuse.cost_governor is not None:
+                self.b2_file.b2fuse.cost_governor.on_download(
+                    self.b2_file.b2fuse.name, self.b2_file.file_info['fileName'], len(data), end
+                )
+            in_flight = self.parallel_counter.value()
+            self.b2_file.b2fuse.event_ring.record(
+                FETCH, self.b2_file.file_info['fileName'], offset, length, start - queued, end - start, in_flight,
+            )
+            logger.debug('\033[33mdownloading from b2: %s; offset = %s; length = %s; time=\033[0m%f, wait=%f, thr=%i', self.b2_file.file_info['fileName'], offset, length, end-start, start-queued, in_flight)
+        finally:
+            self.parallel_counter.add(-1)
+        return data
 
+    def _fetch_data(self, offset, length, keep_it, priority=DEMAND, reserved=False):
+        """
+        with `reserved`, the range goes to the hot tier, within pinned budget the caller has reserved for it
+        """
+        self.fetches.add(1)
+        start = time.time()
+        data = self.download(offset, length, priority)
+        if reserved:
+            tier = HOT
+        else:
+            tier = PINNED if keep_it else self._admit(offset, offset + len(data))
+        segment = Segment(offset, offset + len(data), data, tier, start)
         with self.lock:
-            if keep_it:
-                self.perm[offset: length + offset] = data
-            else:
-                self.temp.add_and_remember(offset, length + offset, data, start)
+            new_parts = self.ranges.missing_parts(segment)
+            self.ranges = self.ranges.add_parts(new_parts)
+        if tier == HOT:
+            self.b2_file.b2fuse.pinned_budget.release(len(data) - sum(map(len, new_parts)))
+            self._schedule_cool_down()
+        elif tier == TEMP:
+            self._schedule_expiry(new_parts, start)
         return data
 
+    def _schedule_expiry(self, segments, created):
+        timer_wheel = self.b2_file.b2fuse.timer_wheel
+        expires = created + self.b2_file.b2fuse.cache_ttl
+        for segment in segments:
+            timer_wheel.schedule(expires, self.expire, segment)
+
+    def _blocks(self, begin, end):
+        return range(begin // PROMOTION_BLOCK_SIZE, (end - 1) // PROMOTION_BLOCK_SIZE + 1)
+
+    def _count(self, begin, end):
+        aged = False
+        for block in self._blocks(begin, end):
+            aged |= self.sketch.increment(block)
+        if aged:
+            self._demote_cold()
+
+    def _admit(self, begin, end):
+        """
+        count the download and return the tier the downloaded range should be kept in
+        """
+        self._count(begin, end)
+        if all(self.sketch.estimate(block) < self.promote_after for block in self._blocks(begin, end)):
+            return TEMP
+        if not self.b2_file.b2fuse.pinned_budget.try_reserve(end - begin):
+            return TEMP
+        logger.info('promoting %s; offset = %s; length = %s', self.b2_file.file_info['fileName'], begin, end - begin)
+        return HOT
+
+    def _schedule_cool_down(self):
+        if self.cool_down_timer is None:
+            self.cool_down_timer = self.b2_file.b2fuse.timer_wheel.schedule(
+                time.time() + COOL_DOWN_INTERVAL, self.cool_down, None,
+            )
+
+    def cool_down(self, items):
+        self.cool_down_timer = None
+        self.sketch.age()
+        if self._demote_cold():
+            self._schedule_cool_down()
+
+    def _demote_cold(self):
+        """
+        move hot ranges which are not read anymore back to the temporary tier,
+        return True if some hot ranges are left
+        """
+        now = time.time()
+        with self.lock:
+            hot = [segment for segment in self.ranges if segment.tier == HOT]
+            cold = [
+                segment for segment in hot
+                if all(self.sketch.estimate(block) == 0 for block in self._blocks(segment.begin, segment.end))
+            ]
+            demoted = [Segment(segment.begin, segment.end, segment.data, TEMP, now) for segment in cold]
+            self.ranges = self.ranges.remove(cold).add_parts(demoted)
+        if cold:
+            logger.info('demoting %s ranges of %s', len(cold), self.b2_file.file_info['fileName'])
+            self.b2_file.b2fuse.pinned_budget.release(sum(map(len, cold)))
+            self._schedule_expiry(demoted, now)
+        return len(hot) > len(cold)
+
     def amplify_read(self, offset, length):
         """
         return new_offset <= offset and length >= offset-new_offset+length
         """
         requested_length = length
 
-        length = max(MIN_READ_LEN_WITHOUT_CACHE, requested_length)
+        min_read_length = self.min_read_length
+        cost_governor = self.b2_file.b2fuse.cost_governor
+        if cost_governor is not None and cost_governor.saving:
+            # bytes beyond the read are only worth their egress when the budget allows
+            min_read_length = min(min_read_length, self.b2_file.b2fuse.min_read_length)
+        length = max(min_read_length, requested_length)
 
         return offset, length, offset == 0
 
     def get(self, offset, length):
-        logger.info(
+        logger.debug(
             'getting: %s; offset = %s; length = %s',
             self.b2_file.file_info['fileName'],
             offset,
             length,
         )
-        read_range_start = offset
-        read_range_end = offset + length - 1
+        if self.prefetcher is not None:
+            self.prefetcher.on_read(offset, length)
+        slo_monitor = self.b2_file.b2fuse.slo_monitor
+        if slo_monitor is None:
+            return self.lookup(offset, length)
+        started = time.time()
+        data = self.lookup(offset, length)
+        self.min_read_length, self.promote_after = slo_monitor.on_read(
+            self.b2_file.b2fuse.name, self.b2_file.file_info['fileName'], started, time.time()
+        )
+        return data
 
-        with self.lock:
-            intervals_set = self.temp[read_range_start: read_range_end] | self.perm[read_range_start: read_range_end]
+    def lookup(self, offset, length, priority=DEMAND):
+        """
+        return a range from the cache, downloading what is missing, without notifying the prefetcher
+        """
+        sidecar = self.sidecar
+        if sidecar is not None:
+            data = sidecar.read(offset, length)
+            if data is not None:
+                self.b2_file.b2fuse.event_ring.sample(HIT, self.b2_file.file_info['fileName'], offset, length)
+                self.hits.add(1)
+                return data
 
-        intervals = list(intervals_set)
-        intervals.sort()
+        read_range_start = offset
+        read_range_end = offset + length
+
+        segments = self.ranges.find(read_range_start, read_range_end)
 
-        if not intervals:
+        if not segments:
+            self.misses.add(1)
             new_offset, new_length, keep_it = self.amplify_read(offset, length)
-            return self._fetch_data(new_offset, new_length, keep_it)[
+            return self._fetch_data(new_offset, new_length, keep_it, priority)[
                    (offset - new_offset): (offset - new_offset + length)]
 
         result = bytearray()
+        fetched = False
+
+        position = read_range_start
+        for segment in segments:
+            if segment.tier == HOT:
+                # reads keep hot ranges from cooling off
+                for block in self._blocks(max(read_range_start, segment.begin), min(segment.end, read_range_end)):
+                    if self.sketch.increment(block):
+                        self._demote_cold()
+            if segment.begin > position:
+                logger.debug('filling up a hole of %s at %s', segment.begin - position, position)
+                fetched = True
+                result.extend(self._fetch_data(position, segment.begin - position, False, priority))
+            slice_start = max(read_range_start, segment.begin) - segment.begin
+            slice_end = min(segment.end, read_range_end) - segment.begin
+            logger.debug('\033[32madding from cache: %s. \n'
+                         'Original interval parameters: offset = %s; length = %s\n'
+                         'Using slice: [%s: %s]\033[0m',
+                         self.b2_file.file_info['fileName'], segment.begin, len(segment), slice_start, slice_end)
+            result.extend(segment.data[slice_start: slice_end])
+            position = segment.begin + slice_end
 
-        if intervals[0].begin > read_range_start:
-            logger.info('extending read range start of %s by %s', intervals[0].begin,
-                        intervals[0].begin - read_range_start)
-            result.extend(self._fetch_data(read_range_start, intervals[0].begin - read_range_start, False))
-
-        prev_end = None
-        overlap = 0
-        for interval in intervals:
-            if prev_end:
-
-                if interval.begin > prev_end:
-                    logger.info('filling up a hole')
-                    result.extend(self._fetch_data(prev_end, interval.begin - prev_end, False))
-                overlap = max(prev_end - interval.begin, 0)
-            interval_slice_start = max(read_range_start - interval.begin, 0) + overlap
-            interval_slice_end = min(interval.end, read_range_end) - interval.begin + 1
-            logger.info(f'\033[32madding from cache: {self.b2_file.file_info["fileName"]}. \n'
-                        f'Original interval parameters: offset = {interval.begin}; length = {interval.end - interval.begin}\n'
-                        f'Using slice: [{interval_slice_start}: {interval_slice_end}]\033[0m')
-
-            prev_end = interval.end
-            result.extend(interval.data[interval_slice_start: interval_slice_end])
-
-        result_len = len(result)
-        if result_len < length:
-            logger.info('extending read range end of %s by %s', result_len + offset, length - result_len)
-            result.extend(self._fetch_data(result_len + offset, length - result_len, False))
+        if position < read_range_end:
+            logger.debug('extending read range end of %s by %s', position, read_range_end - position)
+            fetched = True
+            result.extend(self._fetch_data(position, read_range_end - position, False, priority))
 
+        if fetched:
+            self.misses.add(1)
+        else:
+            self.hits.add(1)
+        self.b2_file.b2fuse.event_ring.sample(HIT, self.b2_file.file_info['fileName'], offset, length)
         return bytes(result)
 
-    def evict(self, older_than_timestamp: float):
+    def stats(self):
+        """
+        return the values of CACHE_STATS
+        """
+        tier_bytes = {TEMP: 0, PINNED: 0, HOT: 0}
+        ranges = self.ranges
+        for segment in ranges:
+            tier_bytes[segment.tier] += len(segment)
+        hits = self.hits.value()
+        lookups = hits + self.misses.value()
+        return {
+            'temp_bytes': tier_bytes[TEMP],
+            'pinned_bytes': tier_bytes[PINNED],
+            'hot_bytes': tier_bytes[HOT],
+            'intervals': len(ranges),
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'fetches': self.fetches.value(),
+            'last_fetch_latency': self.last_fetch_latency or 0.0,
+        }
+
+    def prefetch(self, offset, length):
+        """
+        download a range in the background class and keep it in the hot tier, as far as the
+        budget of the pinned cache allows; return the number of bytes which were kept
+        """
+        pinned_budget = self.b2_file.b2fuse.pinned_budget
+        end = min(offset + length, self.b2_file.file_info['size'])
+        for begin in range(offset, end, PREFETCH_CHUNK):
+            chunk_end = min(begin + PREFETCH_CHUNK, end)
+            if self._cached_bytes(begin, chunk_end) == chunk_end - begin:
+                continue
+            if not pinned_budget.try_reserve(chunk_end - begin):
+                logger.warning(
+                    'prefetching %s stops at offset %s: the pinned cache is full',
+                    self.b2_file.file_info['fileName'], begin,
+                )
+                return begin - offset
+            try:
+                self._fetch_data(begin, chunk_end - begin, False, BACKGROUND, reserved=True)
+            except BaseException:
+                pinned_budget.release(chunk_end - begin)
+                raise
+            # cooled down like ranges promoted by reads, once they are not read anymore
+            self._count(begin, chunk_end)
+        return max(end - offset, 0)
+
+    def hint(self, offset, length):
+        """
+        download a range a read is about to ask for, unless it is cached already, and keep it like one
+        """
+        end = min(offset + length, self.b2_file.file_info['size'])
+        if self._cached_bytes(offset, end) < end - offset:
+            self._fetch_data(offset, end - offset, False, DEMAND)
+
+    def _cached_bytes(self, begin, end):
+        return sum(min(segment.end, end) - max(segment.begin, begin) for segment in self.ranges.find(begin, end))
+
+    def expire(self, segments):
+        with self.lock:
+            self.ranges = self.ranges.remove(segments)
+
+    def close(self):
+        """
+        drop everything, giving the hot tier budget back
+        """
+        if self.cool_down_timer is not None:
+            self.cool_down_timer.cancel()
+            self.cool_down_timer = None
         with self.lock:
-            self.temp.evict(older_than_timestamp)
+            hot_bytes = sum(len(segment) for segment in self.ranges if segment.tier == HOT)
+            self.ranges = RangeMap()
+        self.b2_file.b2fuse.pinned_budget.release(hot_bytes)
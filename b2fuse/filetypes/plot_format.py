@@ -0,0 +1,288 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Layout of Chia plot files, as written by chiapos
+"""
+
+import functools
+import heapq
+import math
+import struct
+
+from typing import List
+
+PLOT_MAGIC = b'Proof of Space Plot'
+PLOT_ID_SIZE = 32
+
+# table_pointers[1:8] point at tables 1 to 7, followed by the checkpoint tables
+C1_TABLE = 8
+C2_TABLE = 9
+C3_TABLE = 10
+
+# large enough for any header chiapos writes (the memo is 128 bytes at most)
+HEADER_READ_SIZE = 4096
+
+
+class PlotHeader:
+    __slots__ = ('plot_id', 'k', 'format_description', 'memo', 'table_pointers', 'size')
+
+    def __init__(self, plot_id: bytes, k: int, format_description: bytes, memo: bytes, table_pointers: List[int],
+                 size: int):
+        self.plot_id = plot_id
+        self.k = k
+        self.format_description = format_description
+        self.memo = memo
+        self.table_pointers = table_pointers
+        self.size = size
+
+    @classmethod
+    def parse(cls, data: bytes) -> 'PlotHeader':
+        """
+        raise ValueError if `data` does not start with a complete plot header
+        """
+        try:
+            if data[:len(PLOT_MAGIC)] != PLOT_MAGIC:
+                raise ValueError('not a plot file')
+            position = len(PLOT_MAGIC)
+            plot_id = data[position:position + PLOT_ID_SIZE]
+            position += PLOT_ID_SIZE
+            k = data[position]
+            position += 1
+            format_description_size, = struct.unpack_from('>H', data, position)
+            position += 2
+            format_description = data[position:position + format_description_size]
+            position += format_description_size
+            memo_size, = struct.unpack_from('>H', data, position)
+            position += 2
+            memo = data[position:position + memo_size]
+            position += memo_size
+            table_pointers = [0] + list(struct.unpack_from('>10Q', data, position))
+            position += 10 * 8
+        except (IndexError, struct.error):
+            raise ValueError('truncated plot header')
+        return cls(bytes(plot_id), k, bytes(format_description), bytes(memo), table_pointers, position)
+
+
+ENTRIES_PER_PARK = 2048
+STUB_MINUS_BITS = 3
+MAX_AVERAGE_DELTA_TABLE1 = 5.6
+MAX_AVERAGE_DELTA = 3.5
+CHECKPOINT1_INTERVAL = 10000
+C3_BITS_PER_ENTRY = 2.4
+# parameters of the ANS coding of line point deltas in tables 1 to 6
+R_VALUES = [4.7, 2.75, 2.75, 2.7, 2.6, 2.45]
+ANS_TABLE_LOG = 14
+# chiapos uses this truncated constant, so it is needed to get the same probabilities
+E = 2.718281828459
+
+
+def _byte_align(bits) -> int:
+    # chiapos passes doubles to a uint64_t argument, which truncates them
+    bits = int(bits)
+    return bits + (8 - bits % 8) % 8
+
+
+class PlotLayout:
+    """
+    Offsets of parks in the tables of a plot, and decoding of their entries
+    """
+
+    def __init__(self, header: PlotHeader):
+        self.header = header
+        self.k = header.k
+        self.line_point_size = _byte_align(2 * self.k) // 8
+        self.stubs_size = _byte_align((ENTRIES_PER_PARK - 1) * (self.k - STUB_MINUS_BITS)) // 8
+
+    def park_size(self, table: int) -> int:
+        if table == 7:
+            return _byte_align((self.k + 1) * ENTRIES_PER_PARK) // 8
+        if table == C3_TABLE:
+            if self.k < 20:
+                return _byte_align(8 * CHECKPOINT1_INTERVAL) // 8
+            return _byte_align(C3_BITS_PER_ENTRY * CHECKPOINT1_INTERVAL) // 8
+        max_average_delta = MAX_AVERAGE_DELTA_TABLE1 if table == 1 else MAX_AVERAGE_DELTA
+        max_deltas_size = _byte_align((ENTRIES_PER_PARK - 1) * max_average_delta) // 8
+        return self.line_point_size + self.stubs_size + max_deltas_size
+
+    def entries(self, table: int) -> int:
+        """
+        upper bound of positions in a table of parks
+        """
+        pointers = self.header.table_pointers
+        return (pointers[table + 1] - pointers[table]) // self.park_size(table) * ENTRIES_PER_PARK
+
+    def locate(self, offset: int):
+        """
+        return (table, park index) of the park of tables 1 to 7 which contains `offset`, or None
+        """
+        pointers = self.header.table_pointers
+        for table in range(1, 8):
+            if pointers[table] <= offset < pointers[table + 1]:
+                return table, (offset - pointers[table]) // self.park_size(table)
+        return None
+
+    def park_range(self, table: int, park_index: int):
+        begin = self.header.table_pointers[table] + park_index * self.park_size(table)
+        return begin, begin + self.park_size(table)
+
+    def decode_p7_park(self, park: bytes) -> List[int]:
+        """
+        return positions in table 6 stored in a park of table 7
+        """
+        entry_bits = self.k + 1
+        value = int.from_bytes(park, 'big')
+        total_bits = len(park) * 8
+        mask = (1 << entry_bits) - 1
+        return [
+            (value >> (total_bits - (idx + 1) * entry_bits)) & mask
+            for idx in range(min(ENTRIES_PER_PARK, total_bits // entry_bits))
+        ]
+
+    def decode_line_point(self, table: int, park: bytes, index: int) -> int:
+        """
+        return the line point of entry `index` of a park of tables 1 to 6
+        """
+        line_point = int.from_bytes(park[:self.line_point_size], 'big') >> (self.line_point_size * 8 - 2 * self.k)
+        stubs = park[self.line_point_size:self.line_point_size + self.stubs_size]
+        deltas_start = self.line_point_size + self.stubs_size
+        encoded_deltas_size = park[deltas_start] | park[deltas_start + 1] << 8
+        encoded_deltas = park[deltas_start + 2:deltas_start + 2 + (encoded_deltas_size & 0x7fff)]
+        if encoded_deltas_size & 0x8000:
+            deltas = encoded_deltas
+        else:
+            deltas = ans_decode(encoded_deltas, ENTRIES_PER_PARK - 1, R_VALUES[table - 1])
+        if 0xff in deltas:
+            raise ValueError('bad delta')
+
+        count = min(index, len(deltas))
+        stub_bits = self.k - STUB_MINUS_BITS
+        stubs_value = int.from_bytes(stubs, 'big')
+        stubs_total_bits = len(stubs) * 8
+        stub_mask = (1 << stub_bits) - 1
+        sum_stubs = sum(
+            (stubs_value >> (stubs_total_bits - (idx + 1) * stub_bits)) & stub_mask for idx in range(count)
+        )
+        return line_point + (sum(deltas[:count]) << stub_bits) + sum_stubs
+
+
+def line_point_to_square(line_point: int):
+    """
+    return (x, y) such that line_point == x * (x - 1) / 2 + y and y < x
+    """
+    x = (math.isqrt(8 * line_point + 1) + 1) // 2
+    while x * (x - 1) // 2 > line_point:
+        x -= 1
+    return x, line_point - x * (x - 1) // 2
+
+
+@functools.lru_cache(maxsize=None)
+def _normalized_count(r: float) -> List[int]:
+    """
+    symbol counts of the ANS table for deltas, computed the same way as chiapos does
+    """
+    dpdf = []
+    p = 1 - math.pow((E - 1) / E, 1.0 / r)
+    while p > 1e-50 and len(dpdf) < 255:
+        dpdf.append(p)
+        p = (math.pow(E, 1.0 / r) - 1) * math.pow(E - 1, 1.0 / r)
+        p = p / math.pow(E, (len(dpdf) + 1) / r)
+
+    counts = [1] * len(dpdf)
+    heap = [(-dpdf[idx], idx) for idx in range(len(dpdf))]
+    heapq.heapify(heap)
+    for _ in range((1 << ANS_TABLE_LOG) - len(dpdf)):
+        _, idx = heapq.heappop(heap)
+        counts[idx] += 1
+        heapq.heappush(heap, (-dpdf[idx] * (math.log2(counts[idx] + 1) - math.log2(counts[idx])), idx))
+    return [-1 if count == 1 else count for count in counts]
+
+
+@functools.lru_cache(maxsize=None)
+def _decoding_table(r: float):
+    """
+    (symbol, bit count, base state) for every state, as built by FSE_buildDTable
+    """
+    counts = _normalized_count(r)
+    table_size = 1 << ANS_TABLE_LOG
+    high_threshold = table_size - 1
+    symbols = [0] * table_size
+    symbol_next = []
+    for symbol, count in enumerate(counts):
+        if count == -1:
+            symbols[high_threshold] = symbol
+            high_threshold -= 1
+            symbol_next.append(1)
+        else:
+            symbol_next.append(count)
+
+    step = (table_size >> 1) + (table_size >> 3) + 3
+    mask = table_size - 1
+    position = 0
+    for symbol, count in enumerate(counts):
+        for _ in range(count):
+            symbols[position] = symbol
+            position = (position + step) & mask
+            while position > high_threshold:
+                position = (position + step) & mask
+
+    table = []
+    for symbol in symbols:
+        next_state = symbol_next[symbol]
+        symbol_next[symbol] += 1
+        bit_count = ANS_TABLE_LOG - (next_state.bit_length() - 1)
+        table.append((symbol, bit_count, (next_state << bit_count) - table_size))
+    return table
+
+
+def ans_decode(data: bytes, count: int, r: float) -> bytes:
+    """
+    decode at most `count` deltas, as FSE_decompress_usingDTable does
+    """
+    if not data or not data[-1]:
+        raise ValueError('missing end of ANS stream')
+    table = _decoding_table(r)
+    stream = int.from_bytes(data, 'little')
+    # the stream is read backwards, starting right below its highest set bit
+    position = stream.bit_length() - 1
+
+    def read_bits(bit_count):
+        nonlocal position
+        position -= bit_count
+        if position >= 0:
+            return (stream >> position) & ((1 << bit_count) - 1)
+        return (stream << -position) & ((1 << bit_count) - 1)
+
+    states = [read_bits(ANS_TABLE_LOG), read_bits(ANS_TABLE_LOG)]
+    result = bytearray()
+    turn = 0
+    while len(result) < count:
+        symbol, bit_count, base = table[states[turn]]
+        result.append(symbol)
+        states[turn] = base + read_bits(bit_count)
+        if position < 0:
+            result.append(table[states[1 - turn]][0])
+            break
+        turn ^= 1
+    if position >= 0 or len(result) > count:
+        raise ValueError('ANS stream does not match the expected number of deltas')
+    return bytes(result)
@@ -0,0 +1,121 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import time
+
+from collections import defaultdict
+
+from ..fetch_scheduler import PREFETCH
+from .plot_format import PlotHeader, PlotLayout, line_point_to_square, HEADER_READ_SIZE, ENTRIES_PER_PARK
+
+logger = logging.getLogger(__name__)
+
+# a full proof re-reads the park of table 6 which the quality check has just read
+FULL_PROOF_WINDOW = 30
+PREFETCH_THREADS = 16
+
+
+class PlotPrefetcher:
+    """
+    Speculatively walks the proof tree of a plot ahead of chiapos.
+
+    Reads only show which park chiapos is in, not which of its 2048 entries it needs. The walk
+    therefore starts from table 7: every position stored in the last park of table 7 that was
+    read is a candidate root in table 6. When chiapos reads a table 6 park containing a candidate
+    for the second time within FULL_PROOF_WINDOW, a full proof has started after a quality check.
+    From there every position is exact, so each park is decoded as soon as it is downloaded and
+    both of its children are fetched in parallel, down to table 1.
+    """
+
+    def __init__(self, data_cache, executor):
+        self.data_cache = data_cache
+        self.executor = executor
+        self.layout = None
+        self._candidates = {}
+        self._root_visits = {}
+        self.executor.submit(self._guarded, self._load_layout)
+
+    def on_read(self, offset, length):
+        layout = self.layout
+        if layout is None:
+            return
+        location = layout.locate(offset)
+        if location is None:
+            return
+        table, park_index = location
+        if table == 7:
+            self.executor.submit(self._guarded, self._read_p7_park, park_index)
+        elif table == 6 and offset <= layout.park_range(6, park_index)[0] < offset + length:
+            self._visit_root(park_index)
+
+    def _guarded(self, function, *args):
+        try:
+            function(*args)
+        except Exception as e:
+            # the plot does not look like what the decoder expects, stop speculating on this branch
+            logger.debug('plot prefetch of %s stopped: %r', self.data_cache.b2_file.file_info['fileName'], e)
+
+    def _load_layout(self):
+        if self.layout is None:
+            self.layout = PlotLayout(PlotHeader.parse(self.data_cache.lookup(0, HEADER_READ_SIZE, PREFETCH)))
+
+    def _read_park(self, table, park_index):
+        begin, end = self.layout.park_range(table, park_index)
+        # chiapos reads parks in 8KiB steps, fetch as much as the read amplification would
+        length = max(end - begin, self.data_cache.min_read_length)
+        return self.data_cache.lookup(begin, length, PREFETCH)[:end - begin]
+
+    def _read_p7_park(self, park_index):
+        candidates = defaultdict(list)
+        for position in self.layout.decode_p7_park(self._read_park(7, park_index)):
+            candidates[position // ENTRIES_PER_PARK].append(position)
+        self._candidates = candidates
+
+    def _visit_root(self, park_index):
+        now = time.time()
+        last_visit = self._root_visits.get(park_index)
+        self._root_visits = {
+            idx: visit for idx, visit in self._root_visits.items() if now - visit < FULL_PROOF_WINDOW
+        }
+        self._root_visits[park_index] = now
+        if last_visit is None or now - last_visit >= FULL_PROOF_WINDOW:
+            return
+        for position in self._candidates.get(park_index, ()):
+            logger.info(
+                'prefetching full proof of %s from position %s',
+                self.data_cache.b2_file.file_info['fileName'],
+                position,
+            )
+            self.executor.submit(self._guarded, self._walk, 6, position)
+
+    def _walk(self, table, position):
+        park_index, index = divmod(position, ENTRIES_PER_PARK)
+        line_point = self.layout.decode_line_point(table, self._read_park(table, park_index), index)
+        if table == 1:
+            return
+        x, y = line_point_to_square(line_point)
+        if not y <= x < self.layout.entries(table - 1):
+            raise ValueError(f'entry {position} of table {table} points outside of table {table - 1}')
+        # chiapos follows y first
+        self.executor.submit(self._guarded, self._walk, table - 1, y)
+        self.executor.submit(self._guarded, self._walk, table - 1, x)
@@ -0,0 +1,124 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from bisect import bisect_right
+from typing import Iterable, List
+
+TEMP = 0
+PINNED = 1
+HOT = 2
+
+
+class Segment:
+    __slots__ = ('begin', 'end', 'data', 'tier', 'created')
+
+    def __init__(self, begin: int, end: int, data, tier: int, created: float):
+        self.begin = begin
+        self.end = end
+        self.data = data
+        self.tier = tier
+        self.created = created
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def slice(self, begin: int, end: int) -> 'Segment':
+        return Segment(
+            begin,
+            end,
+            self.data[begin - self.begin:end - self.begin],
+            self.tier,
+            self.created,
+        )
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.begin}, {self.end}, tier={self.tier}, created={self.created})'
+
+
+class RangeMap:
+    """
+    Immutable, sorted set of non-overlapping byte ranges.
+
+    Readers use whatever snapshot they picked up without taking any lock, writers build
+    a new map and swap the reference in one assignment.
+    """
+    __slots__ = ('_begins', '_segments')
+
+    def __init__(self, segments: Iterable[Segment] = ()):
+        self._segments = tuple(segments)
+        self._begins = tuple(segment.begin for segment in self._segments)
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __iter__(self):
+        return iter(self._segments)
+
+    def find(self, begin: int, end: int) -> List[Segment]:
+        """
+        return segments overlapping [begin, end), sorted by offset
+        """
+        idx = max(bisect_right(self._begins, begin) - 1, 0)
+        result = []
+        for segment in self._segments[idx:]:
+            if segment.begin >= end:
+                break
+            if segment.end > begin:
+                result.append(segment)
+        return result
+
+    def missing_parts(self, segment: Segment) -> List[Segment]:
+        """
+        return the parts of `segment` that are not in this map yet
+        """
+        new_parts = []
+        position = segment.begin
+        for existing in self.find(segment.begin, segment.end):
+            if existing.begin > position:
+                new_parts.append(segment.slice(position, existing.begin))
+            position = max(position, existing.end)
+        if position < segment.end:
+            new_parts.append(segment if position == segment.begin else segment.slice(position, segment.end))
+        return new_parts
+
+    def add_parts(self, parts: List[Segment]) -> 'RangeMap':
+        """
+        return a new map with `parts` added, they must not overlap anything in this map
+        """
+        if not parts:
+            return self
+        segments = list(self._segments)
+        begins = list(self._begins)
+        for part in parts:
+            idx = bisect_right(begins, part.begin)
+            begins.insert(idx, part.begin)
+            segments.insert(idx, part)
+        return RangeMap(segments)
+
+    def insert(self, segment: Segment) -> 'RangeMap':
+        return self.add_parts(self.missing_parts(segment))
+
+    def remove(self, segments: Iterable[Segment]) -> 'RangeMap':
+        to_remove = {id(segment) for segment in segments}
+        if not to_remove:
+            return self
+        return RangeMap(segment for segment in self._segments if id(segment) not in to_remove)
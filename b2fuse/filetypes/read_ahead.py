@@ -0,0 +1,123 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+import threading
+
+from collections import OrderedDict
+
+from ..fetch_scheduler import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+# bytes a handle has to read in order before it is served by read-ahead
+STREAM_AFTER = 1 * MiB
+READ_AHEAD_CHUNK = 4 * MiB
+# chunks downloaded ahead of the reader, doubled every time it catches up with them
+MIN_WINDOW = 2
+MAX_WINDOW = 8
+READ_AHEAD_THREADS = 16
+
+
+class ReadAheadStream:
+    """
+    Sequential reads of one file handle, such as those of cp or sha256sum.
+
+    Once a handle has read STREAM_AFTER bytes in order, its reads are served from chunks of
+    READ_AHEAD_CHUNK downloaded ahead of it, in the background class so that they give way to
+    proof reads. The chunks are kept in a ring of their own, which drops chunks as soon as the
+    reader is past them, and not in the cache of the file, so that bulk reads do not push out
+    the ranges proofs need. A read elsewhere than where the previous one ended stops read-ahead.
+    """
+
+    def __init__(self, data_cache, executor):
+        self.data_cache = data_cache
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._next = None
+        self._sequential = 0
+        self._streaming = False
+        self._window = MIN_WINDOW
+        self._chunks = OrderedDict()  # chunk index -> future of its data
+
+    def _reset(self):
+        self._drop_before(float('inf'))
+        self._sequential = 0
+        self._streaming = False
+        self._window = MIN_WINDOW
+
+    def _chunk(self, index):
+        future = self._chunks.get(index)
+        if future is None:
+            begin = index * READ_AHEAD_CHUNK
+            length = min(READ_AHEAD_CHUNK, self.data_cache.b2_file.file_info['size'] - begin)
+            future = self._chunks[index] = self.executor.submit(self.data_cache.download, begin, length, BACKGROUND)
+        return future
+
+    def _drop_before(self, index):
+        while self._chunks and next(iter(self._chunks)) < index:
+            self._chunks.popitem(last=False)[1].cancel()
+
+    def read(self, offset, length):
+        """
+        return the data of a read once the handle streams, or None when the read has to go through the cache
+        """
+        size = self.data_cache.b2_file.file_info['size']
+        with self._lock:
+            if offset != self._next:
+                self._reset()
+            streaming = self._sequential >= STREAM_AFTER
+            self._next = offset + length
+            self._sequential += length
+            end = min(offset + length, size)
+            if not streaming or offset >= end:
+                return None
+            if not self._streaming:
+                self._streaming = True
+                logger.info('reading %s sequentially from %s', self.data_cache.b2_file.file_info['fileName'], offset)
+
+            first, last = offset // READ_AHEAD_CHUNK, (end - 1) // READ_AHEAD_CHUNK
+            self._drop_before(first)
+            futures = [self._chunk(index) for index in range(first, last + 1)]
+            if not futures[-1].done():
+                self._window = min(self._window * 2, MAX_WINDOW)
+            for index in range(last + 1, min(last + 1 + self._window, (size - 1) // READ_AHEAD_CHUNK + 1)):
+                self._chunk(index)
+
+        try:
+            chunks = [future.result() for future in futures]
+        except Exception as e:
+            logger.info('read-ahead of %s stopped: %r', self.data_cache.b2_file.file_info['fileName'], e)
+            with self._lock:
+                self._reset()
+            return None
+        start = offset - first * READ_AHEAD_CHUNK
+        if len(chunks) == 1:
+            return bytes(chunks[0][start:start + end - offset])
+        return b''.join(chunks)[start:start + end - offset]
+
+    def close(self):
+        with self._lock:
+            self._reset()
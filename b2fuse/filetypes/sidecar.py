@@ -0,0 +1,192 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from ..cost_governor import BudgetExceeded
+from ..fetch_scheduler import BACKGROUND
+from .plot_format import PlotHeader, HEADER_READ_SIZE, C1_TABLE, C3_TABLE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIDECAR_DIR = os.path.expanduser('~/.cache/b2fs4chia/sidecars')
+SIDECAR_SUFFIX = '.sidecar'
+# C1 and C2 of a k=32 plot take less than 2MiB, anything much larger is not a sane plot
+MAX_SIDECAR_SIZE = 64 * 1024 * 1024
+# room for the sidecars of about 500 k=32 plots, the least recently used are deleted beyond it
+DEFAULT_SIDECAR_DIR_SIZE = 1024 * 1024 * 1024
+BUILD_THREADS = 4
+
+
+class Sidecar:
+    """
+    Local copy of some ranges of a file.
+
+    The sidecar file starts with one line of JSON listing the ranges as [begin, end] pairs,
+    followed by their data in the same order.
+    """
+
+    def __init__(self, path: str, ranges: List[Tuple[int, int]], data_start: int):
+        self.path = path
+        self.ranges = ranges
+        self._positions = []
+        position = data_start
+        for begin, end in ranges:
+            self._positions.append(position)
+            position += end - begin
+
+    @classmethod
+    def load(cls, path) -> 'Sidecar':
+        with open(path, 'rb') as f:
+            index = f.readline()
+            return cls(path, [tuple(r) for r in json.loads(index)['ranges']], len(index))
+
+    @classmethod
+    def write(cls, path, ranges: List[Tuple[int, bytes]]) -> 'Sidecar':
+        index = json.dumps({'ranges': [[begin, begin + len(data)] for begin, data in ranges]}).encode() + b'\n'
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(index)
+            for _, data in ranges:
+                f.write(data)
+        os.replace(tmp_path, path)
+        return cls(path, [(begin, begin + len(data)) for begin, data in ranges], len(index))
+
+    def read(self, offset, length) -> Optional[bytes]:
+        """
+        return None unless the whole [offset, offset + length) range is in the sidecar
+        """
+        for (begin, end), position in zip(self.ranges, self._positions):
+            if begin <= offset and offset + length <= end:
+                try:
+                    with open(self.path, 'rb') as f:
+                        f.seek(position + offset - begin)
+                        return f.read(length)
+                except FileNotFoundError:
+                    # deleted to make room for sidecars of other plots
+                    return None
+        return None
+
+
+class SidecarStore:
+    """
+    Keeps plot headers and checkpoint tables C1 and C2 of plots in local files named after the
+    fileId, so that most of a quality check is served without downloading anything.
+
+    The files take at most `max_size` bytes: the ones of plots which were opened least recently,
+    according to their modification time, are deleted to make room for new ones.
+    """
+
+    def __init__(self, directory=DEFAULT_SIDECAR_DIR, max_size=DEFAULT_SIDECAR_DIR_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(BUILD_THREADS, thread_name_prefix='sidecar')
+        self._not_plots = set()
+        self._lock = threading.Lock()
+        # sizes of the sidecar files, least recently used first
+        self._sizes = OrderedDict()
+        self._size = 0
+        existing = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(SIDECAR_SUFFIX):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(existing):
+            self._sizes[path] = size
+            self._size += size
+        self._make_room()
+
+    def _path(self, file_id):
+        return os.path.join(self.directory, file_id + SIDECAR_SUFFIX)
+
+    def attach(self, data_cache):
+        """
+        set `data_cache.sidecar` now if the sidecar exists, or once it is built in the background
+        """
+        file_info = data_cache.b2_file.file_info
+        if not file_info['fileName'].endswith('.plot') or file_info['fileId'] in self._not_plots:
+            return
+        path = self._path(file_info['fileId'])
+        try:
+            data_cache.sidecar = Sidecar.load(path)
+            self._used(path)
+            return
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception('Error when loading sidecar %s, building it again', path)
+        self._executor.submit(self._build, data_cache, path)
+
+    def _build(self, data_cache, path):
+        file_info = data_cache.b2_file.file_info
+        try:
+            header_data = data_cache.lookup(0, HEADER_READ_SIZE, BACKGROUND)
+            header = PlotHeader.parse(header_data)
+            begin, end = header.table_pointers[C1_TABLE], header.table_pointers[C3_TABLE]
+            if not 0 < begin <= end <= file_info['size'] or end - begin > MAX_SIDECAR_SIZE:
+                raise ValueError(f'unexpected checkpoint tables at [{begin}, {end})')
+            checkpoints = data_cache.download(begin, end - begin, BACKGROUND)
+            data_cache.sidecar = Sidecar.write(path, [(0, header_data[:header.size]), (begin, checkpoints)])
+            self._used(path)
+            logger.info('built sidecar of %s with %s bytes', file_info['fileName'], header.size + len(checkpoints))
+        except ValueError as e:
+            logger.warning('Not building sidecar of %s: %s', file_info['fileName'], e)
+            self._not_plots.add(file_info['fileId'])
+        except BudgetExceeded as e:
+            # built the next time the file is opened
+            logger.info('Not building sidecar of %s now: %s', file_info['fileName'], e)
+        except Exception:
+            logger.exception('Error when building sidecar of %s', file_info['fileName'])
+
+    def _used(self, path):
+        try:
+            # the order survives restarts through the modification time
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size += size - self._sizes.pop(path, 0)
+            self._sizes[path] = size
+        self._make_room()
+
+    def _make_room(self):
+        removed = []
+        with self._lock:
+            while self._size > self.max_size:
+                path, size = self._sizes.popitem(last=False)
+                self._size -= size
+                removed.append(path)
+        for path in removed:
+            logger.info('deleting sidecar %s to make room', path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,104 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Control file at the root of the mount, to which a harvester writes the ranges it is about to
+read, one "<offset> <length> <path>" line each. The write returns once they are all cached.
+"""
+
+import itertools
+import logging
+import threading
+
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+HINTS_PATH = '.b2fs4chia-hints'
+# ranges closer than this are downloaded as one
+MERGE_GAP = 64 * 1024
+HINT_THREADS = 16
+# handles of the control file, far above those of files
+FIRST_HINTS_FH = 1 << 48
+
+
+def parse_hints(data):
+    """
+    return {path: [(offset, length)]} of the lines of `data`, skipping malformed ones
+    """
+    ranges = defaultdict(list)
+    for line in data.decode(errors='replace').splitlines():
+        try:
+            offset, length, path = line.split(None, 2)
+            hint = (int(offset), int(length))
+        except ValueError:
+            if line.strip():
+                logger.warning('ignoring hint %r', line)
+            continue
+        ranges[path.lstrip('/')].append(hint)
+    return ranges
+
+
+def merge_ranges(ranges, gap=MERGE_GAP):
+    """
+    return sorted (offset, length) covering `ranges`, where ranges less than `gap` apart are merged
+    """
+    merged = []
+    for offset, length in sorted(ranges):
+        if merged and offset - (merged[-1][0] + merged[-1][1]) < gap:
+            begin = merged[-1][0]
+            merged[-1] = (begin, max(merged[-1][1], offset + length - begin))
+        else:
+            merged.append((offset, length))
+    return merged
+
+
+class HintWriters:
+    """
+    Open handles of the control file, each with the end of what was written to it which is not a whole line yet
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = itertools.count(FIRST_HINTS_FH)
+        self._partial_lines = {}
+
+    def open(self):
+        fh = next(self._handles)
+        with self._lock:
+            self._partial_lines[fh] = b''
+        return fh
+
+    def write(self, fh, data):
+        """
+        return the hints of the lines `data` completes
+        """
+        with self._lock:
+            lines, _, self._partial_lines[fh] = (self._partial_lines[fh] + data).rpartition(b'\n')
+        return parse_hints(lines)
+
+    def release(self, fh):
+        """
+        return the hints of the last line, if it was not terminated
+        """
+        with self._lock:
+            return parse_hints(self._partial_lines.pop(fh, b''))
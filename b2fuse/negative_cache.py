@@ -0,0 +1,70 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+from collections import OrderedDict
+from time import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NEGATIVE_CACHE_TTL = 30
+# the kernel is never told when a listing finds a path it remembers as missing
+DEFAULT_KERNEL_NEGATIVE_TTL = 0
+DEFAULT_NEGATIVE_CACHE_SIZE = 10000
+
+
+class NegativeCache:
+    """
+    Paths which were looked up and do not exist, each for `ttl` seconds, `size` of them at most
+    """
+
+    def __init__(self, ttl=DEFAULT_NEGATIVE_CACHE_TTL, size=DEFAULT_NEGATIVE_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._expires = OrderedDict()
+
+    def __contains__(self, path):
+        expires = self._expires.get(path)
+        return expires is not None and time() < expires
+
+    def __len__(self):
+        return len(self._expires)
+
+    def add(self, path):
+        with self._lock:
+            self._expires.pop(path, None)
+            self._expires[path] = time() + self.ttl
+            while len(self._expires) > self.size:
+                self._expires.popitem(last=False)
+
+    def discard_if(self, predicate):
+        """
+        forget the paths for which `predicate(path)` is true, and the expired ones
+        """
+        now = time()
+        with self._lock:
+            stale = [path for path, expires in self._expires.items() if expires <= now or predicate(path)]
+            for path in stale:
+                del self._expires[path]
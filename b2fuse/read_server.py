@@ -0,0 +1,132 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Range reads of a running mount without going through the kernel, for a harvester in the same host.
+
+A request is one JSON line, {"reads": [[path, offset, length], ...]}, with paths relative to the
+mountpoint. The reply is one JSON line, {"lengths": [...]} or {"error": ...}, followed by the data
+of all the reads, one after the other. The reads of a request are served concurrently, from the
+same cache and through the same downloads as reads through FUSE.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .unix_server import PrivateUnixServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_SOCKET = os.path.join(tempfile.gettempdir(), 'b2fs4chia-read.sock')
+READ_THREADS = 16
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                data = self._serve(line)
+            except Exception as e:
+                logger.warning('read request %s failed: %s', line, e)
+                self.wfile.write(json.dumps({'error': f'{e.__class__.__name__}: {e}'}).encode() + b'\n')
+                continue
+            header = json.dumps({'lengths': [len(chunk) for chunk in data]}).encode() + b'\n'
+            self.wfile.write(b''.join([header] + data))
+
+    def _serve(self, line):
+        filesystem = self.server.filesystem
+        # files are opened for the request only, a connection kept open by a client must not pin them
+        # (open files stay warm in the file handle table anyway)
+        handles = {}
+        try:
+            reads = json.loads(line)['reads']
+            for path, _, _ in reads:
+                if path not in handles:
+                    handles[path] = filesystem.open(path, os.O_RDONLY)
+            return self.server.read_many(handles, reads)
+        finally:
+            for path, fh in handles.items():
+                filesystem.release(path, fh)
+
+
+class ReadServer(PrivateUnixServer):
+
+    def __init__(self, socket_path, filesystem):
+        self.filesystem = filesystem
+        self.executor = ThreadPoolExecutor(READ_THREADS, thread_name_prefix='read_server')
+        super().__init__(socket_path, _Handler)
+
+    def read_many(self, handles, reads):
+        def read(path, offset, length):
+            return self.filesystem.read(path, length, offset, handles[path])
+
+        if len(reads) == 1:
+            return [read(*reads[0])]
+        return list(self.executor.map(lambda args: read(*args), reads))
+
+
+class RangeReader:
+    """
+    Client of the read socket of a mount, one connection per thread
+    """
+
+    def __init__(self, socket_path=DEFAULT_READ_SOCKET):
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    def read(self, path, offset, length):
+        return self.read_many([(path, offset, length)])[0]
+
+    def read_many(self, reads):
+        """
+        return the data of every (path, offset, length) of `reads`, read with a single request
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            connection = self._local.connection = sock.makefile('rwb')
+            sock.close()  # the file keeps the connection open
+        try:
+            connection.write(json.dumps({'reads': [list(args) for args in reads]}).encode() + b'\n')
+            connection.flush()
+            line = connection.readline()
+            if not line:
+                raise ConnectionError('the mount closed the read socket')
+            reply = json.loads(line)
+            if 'error' in reply:
+                raise OSError(reply['error'])
+            data = [connection.read(length) for length in reply['lengths']]
+        except ConnectionError:
+            self._local.connection = None
+            connection.close()
+            raise
+        return data
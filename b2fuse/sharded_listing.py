@@ -0,0 +1,144 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import string
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LISTING_THREADS = 16
+# shards are split at the following characters of the same class, anything else falls into the last shard
+CHARACTER_CLASSES = [string.digits, string.ascii_lowercase, string.ascii_uppercase]
+MAX_CHARACTER = chr(0x10ffff)
+
+
+def _common_prefix(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return a[:length]
+
+
+def _split_points(first_name, last_name, next_name, stop):
+    """
+    return sorted file names which split [next_name, stop) where the names of the last page varied
+    """
+    common = _common_prefix(first_name, last_name)
+    varying = last_name[len(common):len(common) + 1]
+    points = set()
+    for characters in CHARACTER_CLASSES:
+        if varying and varying in characters:
+            points.update(common + c for c in characters if c > varying)
+    if common and common[-1] != MAX_CHARACTER:
+        # everything after the names which start with `common`
+        points.add(common[:-1] + chr(ord(common[-1]) + 1))
+    return sorted(point for point in points if next_name < point and (stop is None or point < stop))
+
+
+class ShardedListing:
+    """
+    Lists a whole bucket with `threads` concurrent requests.
+
+    The top level is listed with a delimiter, and every folder found there becomes a shard.
+    B2 does not tell how many files are left, so shards are split further as they are
+    discovered: when the first page of a shard is followed by more files, the rest of the
+    shard is cut at the characters where the file names of that page start to differ, and
+    the new shards are listed in parallel.
+    """
+
+    def __init__(self, bucket_api, threads=DEFAULT_LISTING_THREADS, fetch_count=10000):
+        self.bucket_api = bucket_api
+        self.threads = threads
+        self.fetch_count = fetch_count
+
+    def list(self, on_page):
+        """
+        call `on_page(file_infos)`, one call at a time, for every page of every shard
+        """
+        lock = threading.Lock()
+        page_lock = threading.Lock()
+        done = threading.Event()
+        errors = []
+        pending = 0
+        pages = 0
+
+        def locked_on_page(file_infos):
+            nonlocal pages
+            with page_lock:
+                pages += 1
+                on_page(file_infos)
+
+        def submit(start, stop, delimiter=None):
+            nonlocal pending
+            with lock:
+                pending += 1
+            executor.submit(run, start, stop, delimiter)
+
+        def run(start, stop, delimiter):
+            nonlocal pending
+            try:
+                if not errors:
+                    self._list_shard(start, stop, delimiter, locked_on_page, submit)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                with lock:
+                    pending -= 1
+                    if not pending:
+                        done.set()
+
+        with ThreadPoolExecutor(self.threads, thread_name_prefix='listing') as executor:
+            submit('', None, '/')
+            done.wait()
+        if errors:
+            raise errors[0]
+        logger.info('listed bucket with %s pages', pages)
+
+    def _list_shard(self, start, stop, delimiter, on_page, submit):
+        split = False
+        while start is not None:
+            file_infos, folders, next_name = self.bucket_api.list_file_names_page(
+                start, self.fetch_count, delimiter=delimiter
+            )
+            if stop is not None:
+                file_infos = [file_info for file_info in file_infos if file_info['fileName'] < stop]
+                folders = [folder for folder in folders if folder < stop]
+                if next_name is not None and next_name >= stop:
+                    next_name = None
+            for folder in folders:
+                # every name which starts with `folder`, '0' follows '/'
+                submit(folder, folder[:-1] + '0')
+            on_page(file_infos)
+            if next_name is not None and file_infos and not split:
+                # the new shards split themselves after their own first page
+                split = True
+                points = _split_points(file_infos[0]['fileName'], file_infos[-1]['fileName'], next_name, stop)
+                for begin, end in zip(points, points[1:] + [stop]):
+                    submit(begin, end)
+                if points:
+                    stop = points[0]
+            start = next_name
@@ -0,0 +1,184 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+from collections import deque
+
+from .filetypes.data_cache import MIN_READ_LEN_WITHOUT_CACHE, MAX_READ_LEN_WITHOUT_CACHE, PROMOTE_AFTER_DOWNLOADS
+
+logger = logging.getLogger(__name__)
+
+QUALITY_CHECK = 'quality_check'
+FULL_PROOF = 'full_proof'
+# seconds chia gives a harvester to answer
+TARGETS = {QUALITY_CHECK: 5.0, FULL_PROOF: 30.0}
+# reads of a plot further apart than this belong to different lookups
+SESSION_GAP = 1.0
+# a quality check reads a handful of parks, a full proof the 64 leaves of the proof tree
+FULL_PROOF_READS = 32
+# sessions of each plot the report and the feedback are based on
+HISTORY = 20
+# a plot gets more cache when more than this share of its recent sessions missed their target
+MISS_TOLERANCE = 0.1
+REPORT_INTERVAL = 600
+
+
+class _PlotState:
+    __slots__ = ('first', 'last', 'reads', 'history', 'min_read_length', 'promote_after')
+
+    def __init__(self, min_read_length):
+        self.first = None
+        self.last = None
+        self.reads = 0
+        # (kind, seconds, met) of the last sessions
+        self.history = deque(maxlen=HISTORY)
+        # how the caches of the plot download and pin its ranges, kept while it is closed
+        self.min_read_length = min_read_length
+        self.promote_after = PROMOTE_AFTER_DOWNLOADS
+
+
+class SloMonitor:
+    """
+    Cuts the reads of every plot into sessions, at gaps of SESSION_GAP seconds, and measures
+    each session against the deadline of a quality check or of a full proof, depending on how
+    many reads it took.
+
+    After every session, the tuning of the plot changes: a plot which keeps missing its deadlines
+    is read in bigger ranges, which are pinned sooner, and steps back once it is on time. Caches
+    of the plot get the tuning when they are created and with every read.
+    """
+
+    def __init__(self, min_read_length=MIN_READ_LEN_WITHOUT_CACHE):
+        # of plots which are on time
+        self.min_read_length = min_read_length
+        self._lock = threading.Lock()
+        self._plots = {}  # (bucket name, file name) -> _PlotState
+        self._open = set()  # keys of plots with a session in progress
+        self._reported_at = None
+
+    def tuning(self, bucket_name, file_name):
+        """
+        return the min_read_length and promote_after of the caches of a plot
+        """
+        with self._lock:
+            state = self._plots.get((bucket_name, file_name))
+            if state is None:
+                return self.min_read_length, PROMOTE_AFTER_DOWNLOADS
+            return state.min_read_length, state.promote_after
+
+    def set_min_read_length(self, min_read_length):
+        """
+        change the min_read_length of plots which are on time, and put every plot back on it
+        """
+        with self._lock:
+            self.min_read_length = min_read_length
+            for state in self._plots.values():
+                state.min_read_length = min_read_length
+                state.promote_after = PROMOTE_AFTER_DOWNLOADS
+
+    def on_read(self, bucket_name, file_name, started, finished):
+        """
+        return the tuning of the plot, which may have changed if the read started a new session
+        """
+        key = (bucket_name, file_name)
+        with self._lock:
+            state = self._plots.get(key)
+            if state is None:
+                state = self._plots[key] = _PlotState(self.min_read_length)
+            if state.first is not None and started - state.last > SESSION_GAP:
+                self._close(key, state)
+            if state.first is None:
+                state.first = started
+                self._open.add(key)
+            state.reads += 1
+            state.last = max(state.last or finished, finished)
+            return state.min_read_length, state.promote_after
+
+    def close_idle(self, now):
+        """
+        end the sessions which have not seen a read for SESSION_GAP seconds
+        """
+        with self._lock:
+            for key in [key for key in self._open if now - self._plots[key].last > SESSION_GAP]:
+                self._close(key, self._plots[key])
+            if self._reported_at is None:
+                self._reported_at = now
+            elif now - self._reported_at >= REPORT_INTERVAL:
+                self._reported_at = now
+                for bucket_name, kinds in self._report()['buckets'].items():
+                    logger.info('proof deadlines of %s: %s', bucket_name or 'bucket', kinds)
+
+    def _close(self, key, state):
+        kind = FULL_PROOF if state.reads >= FULL_PROOF_READS else QUALITY_CHECK
+        seconds = state.last - state.first
+        met = seconds <= TARGETS[kind]
+        state.history.append((kind, seconds, met))
+        state.first = state.last = None
+        state.reads = 0
+        self._open.discard(key)
+        if not met:
+            logger.warning('%s of %s took %.1fs', kind, key[1], seconds)
+        misses = sum(1 for _, _, met in state.history if not met)
+        if misses > MISS_TOLERANCE * len(state.history):
+            if state.min_read_length < MAX_READ_LEN_WITHOUT_CACHE:
+                state.min_read_length *= 2
+                state.promote_after = 1
+                logger.info('reading %s bytes at least from %s', state.min_read_length, key[1])
+        elif not misses and len(state.history) == HISTORY and state.min_read_length > self.min_read_length:
+            state.min_read_length = max(state.min_read_length // 2, self.min_read_length)
+            if state.min_read_length == self.min_read_length:
+                state.promote_after = PROMOTE_AFTER_DOWNLOADS
+
+    @staticmethod
+    def _summarize(sessions):
+        summary = {}
+        for kind in TARGETS:
+            seconds = sorted(seconds for session_kind, seconds, _ in sessions if session_kind == kind)
+            if seconds:
+                summary[kind] = {
+                    'sessions': len(seconds),
+                    'missed': sum(1 for duration in seconds if duration > TARGETS[kind]),
+                    'median': seconds[len(seconds) // 2],
+                    'max': seconds[-1],
+                }
+        return summary
+
+    def _report(self):
+        plots = {}
+        buckets = {}
+        for (bucket_name, file_name), state in self._plots.items():
+            if state.history:
+                plots.setdefault(bucket_name, {})[file_name] = self._summarize(state.history)
+                buckets.setdefault(bucket_name, []).extend(state.history)
+        return {
+            'buckets': {bucket_name: self._summarize(sessions) for bucket_name, sessions in buckets.items()},
+            'plots': plots,
+        }
+
+    def report(self):
+        """
+        return the outcome of the recent sessions of every bucket, and of every plot of every bucket
+        """
+        with self._lock:
+            return self._report()
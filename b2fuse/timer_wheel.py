@@ -0,0 +1,122 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+from collections import defaultdict
+from time import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK = 0.1
+SLOT_BITS = 6
+LEVELS = 4
+
+
+class Timer:
+    __slots__ = ('expires', 'callback', 'item', 'cancelled')
+
+    def __init__(self, expires: int, callback, item):
+        self.expires = expires
+        self.callback = callback
+        self.item = item
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel (as in the Linux kernel) with `tick` second resolution.
+
+    Scheduling and cancelling are O(1). Each timer is moved down a level at most
+    LEVELS - 1 times before it expires, so expiry is amortized O(1) per timer as well.
+    Expired timers are passed to their callbacks in batches: callback([item, ...]).
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, now=None):
+        self.tick = tick
+        self._slot_count = 1 << SLOT_BITS
+        self._mask = self._slot_count - 1
+        self._levels = [[[] for _ in range(self._slot_count)] for _ in range(LEVELS)]
+        self._current_tick = self._to_tick(time() if now is None else now)
+        self._lock = threading.Lock()
+
+    def _to_tick(self, timestamp: float) -> int:
+        return int(timestamp / self.tick)
+
+    def schedule(self, deadline: float, callback, item) -> Timer:
+        # round up, so that a timer never fires before its deadline
+        timer = Timer(-int(-deadline // self.tick), callback, item)
+        with self._lock:
+            timer.expires = max(timer.expires, self._current_tick + 1)
+            self._place(timer)
+        return timer
+
+    def _place(self, timer: Timer):
+        delta = timer.expires - self._current_tick
+        for level in range(LEVELS - 1):
+            if delta < 1 << (SLOT_BITS * (level + 1)):
+                self._levels[level][(timer.expires >> (SLOT_BITS * level)) & self._mask].append(timer)
+                return
+        # timers further away than the wheel can hold go to the farthest slot
+        # and get placed again when it is cascaded
+        expires = min(timer.expires, self._current_tick + (1 << (SLOT_BITS * LEVELS)) - 1)
+        self._levels[LEVELS - 1][(expires >> (SLOT_BITS * (LEVELS - 1))) & self._mask].append(timer)
+
+    def _cascade(self):
+        # whenever the lower bits of the current tick wrap around to zero, the current slot
+        # of the level above is spread over the levels below it
+        for level in range(1, LEVELS):
+            if (self._current_tick >> (SLOT_BITS * (level - 1))) & self._mask:
+                return
+            idx = (self._current_tick >> (SLOT_BITS * level)) & self._mask
+            timers, self._levels[level][idx] = self._levels[level][idx], []
+            for timer in timers:
+                if not timer.cancelled:
+                    self._place(timer)
+
+    def advance(self, now=None):
+        """
+        expire all timers with a deadline up to `now`
+        """
+        target_tick = self._to_tick(time() if now is None else now)
+        expired = []
+        with self._lock:
+            while self._current_tick < target_tick:
+                self._current_tick += 1
+                self._cascade()
+                idx = self._current_tick & self._mask
+                expired.extend(self._levels[0][idx])
+                self._levels[0][idx] = []
+
+        batches = defaultdict(list)
+        for timer in expired:
+            if not timer.cancelled:
+                batches[timer.callback].append(timer.item)
+        for callback, items in batches.items():
+            try:
+                callback(items)
+            except Exception:
+                logger.exception('Error when expiring %s timers of %s', len(items), callback)
@@ -0,0 +1,91 @@
+# The MIT License (MIT)
+
+# Copyright 2021 Backblaze Inc. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# B2 account tokens are valid for 24 hours
+TOKEN_REFRESH_INTERVAL = 12 * 3600
+TOKEN_RETRY_INTERVAL = 60
+# an expired token reported this soon after a refresh was sent before the refresh
+MIN_REFRESH_INTERVAL = 60
+
+
+class TokenManager:
+    """
+    Authorizes `api` and renews its token every `refresh_interval` seconds in a thread of its own,
+    long before it expires. Requests keep using the current token until the new one has been
+    stored: B2 does not revoke a token when another one is issued.
+
+    b2sdk authorizes again inline when a request fails with an expired token. That goes through
+    refresh() too, so threads which find the token expired at the same time wait for a single
+    authorization.
+    """
+
+    def __init__(self, api, account_id, application_key, refresh_interval=TOKEN_REFRESH_INTERVAL):
+        self.api = api
+        self.account_id = account_id
+        self.application_key = application_key
+        self.refresh_interval = refresh_interval
+        self.authorized_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        self.refresh()
+        self.api.session.authorize_automatically = self._refresh_expired
+        threading.Thread(target=self._refresh_periodically, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        with self._lock:
+            self._authorize()
+
+    def _authorize(self):
+        self.api.authorize_account('production', self.account_id, self.application_key)
+        self.authorized_at = time()
+        logger.info('authorized account %s', self.account_id)
+
+    def _refresh_expired(self):
+        asked_at = time()
+        with self._lock:
+            # unless another thread has just renewed it
+            if asked_at - self.authorized_at >= MIN_REFRESH_INTERVAL:
+                self._authorize()
+        # b2sdk retries the request when this is true
+        return True
+
+    def _refresh_periodically(self):
+        due = self.authorized_at + self.refresh_interval
+        while not self._stop.wait(max(0.0, due - time())):
+            try:
+                self.refresh()
+                due = self.authorized_at + self.refresh_interval
+            except Exception:
+                logger.warning('renewing the token of account %s failed', self.account_id, exc_info=True)
+                due = time() + TOKEN_RETRY_INTERVAL
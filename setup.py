@@ -37,18 +37,21 @@ setup(
     long_description=read('README.md'),
     classifiers=[
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
     ],
     keywords='',
     author='Backblaze',
     packages=find_packages(),
-    install_requires=['b2sdk==1.8.0', 'intervaltree==3.1.0', 'fusepy==2.0.4', 'PyYAML==5.4'],
+    python_requires='>=3.8',
+    install_requires=['b2sdk==1.33.0', 'fusepy==2.0.4', 'PyYAML==5.4', 'urllib3>=1.25,<3'],
     include_package_data=True,
     zip_safe=True,
     entry_points={
-        'console_scripts': ['b2fs4chia = b2fuse.b2fuse:main',],
+        'console_scripts': [
+            'b2fs4chia = b2fuse.b2fuse:main',
+            'b2fs4chia-admin = b2fuse.admin:main',
+            'b2fs4chia-cache = b2fuse.cache_service:main',
+        ],
     }
 )